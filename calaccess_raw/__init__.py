@@ -1,9 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import io
 import os
+import json
+import hashlib
 from django.conf import settings
+from django.utils import six
+from django.db import DEFAULT_DB_ALIAS, connections, router
 default_app_config = 'calaccess_raw.apps.CalAccessRawConfig'
 
+# File extensions for the compression options of the clean CSV files
+CSV_COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
 
 def get_download_directory():
     """
@@ -29,6 +40,150 @@ def get_test_download_directory():
 Set either CALACCESS_TEST_DOWNLOAD_DIR or BASE_DIR in settings.py")
 
 
+def get_csv_compression():
+    """
+    Returns how the clean CSV files are compressed, if at all.
+    """
+    compression = getattr(settings, 'CALACCESS_CSV_COMPRESSION', None)
+    if compression and compression not in CSV_COMPRESSION_EXTENSIONS:
+        raise ValueError("CALACCESS_CSV_COMPRESSION must be one of %s" % (
+            ", ".join(sorted(CSV_COMPRESSION_EXTENSIONS))
+        ))
+    return compression
+
+
+def get_csv_extension():
+    """
+    Returns the file extension of the clean CSV files.
+    """
+    return ".csv" + CSV_COMPRESSION_EXTENSIONS.get(get_csv_compression(), "")
+
+
+def open_csv(path, mode='r', compression=None):
+    """
+    Opens a clean CSV file like the built-in open, compressing or
+    decompressing it on the way if needed.
+
+    Unless it is provided, the compression is determined by the file's extension.
+    """
+    if compression is None:
+        for name, extension in CSV_COMPRESSION_EXTENSIONS.items():
+            if path.endswith(extension):
+                compression = name
+
+    if compression == 'gzip':
+        import gzip
+        fileobj = gzip.open(path, mode.replace('b', '') + 'b')
+    elif compression == 'zstd':
+        import zstandard
+        fileobj = zstandard.open(path, mode.replace('b', '') + 'b')
+    else:
+        return open(path, mode)
+
+    # csvkit reads and writes bytes on Python 2
+    if 'b' in mode or six.PY2:
+        return fileobj
+    return io.TextIOWrapper(fileobj)
+
+
+def get_manifest_path(csv_path):
+    """
+    Returns the path to the manifest that describes a clean CSV file.
+    """
+    return csv_path + '.json'
+
+
+def write_manifest(csv_path, headers, rows_count, normalized=False):
+    """
+    Writes a manifest next to a clean CSV file with its headers, number of
+    rows, size in bytes and SHA-256 checksum, and whether its values were
+    normalized by the fields' to_csv methods.
+
+    Returns the manifest as a dictionary.
+    """
+    checksum = hashlib.sha256()
+    with open(csv_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            checksum.update(chunk)
+
+    manifest = dict(
+        headers=list(headers),
+        rows_count=rows_count,
+        size=os.path.getsize(csv_path),
+        sha256=checksum.hexdigest(),
+        normalized=normalized,
+    )
+    with open(get_manifest_path(csv_path), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def read_manifest(csv_path):
+    """
+    Returns the manifest of a clean CSV file as a dictionary.
+
+    Returns None if there isn't one, or if the file has changed size since
+    the manifest was written.
+    """
+    try:
+        with open(get_manifest_path(csv_path)) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not os.path.exists(csv_path) or os.path.getsize(csv_path) != manifest.get('size'):
+        return None
+    return manifest
+
+
+def get_duckdb_connection(read_only=True):
+    """
+    Returns a connection to the DuckDB database file where the data is copied
+    for analysis, if one is configured.
+    """
+    if not getattr(settings, 'CALACCESS_DUCKDB_PATH', None):
+        raise ValueError("DuckDB database not configured. Set CALACCESS_DUCKDB_PATH \
+in settings.py")
+    import duckdb
+    return duckdb.connect(settings.CALACCESS_DUCKDB_PATH, read_only=read_only)
+
+
+def query_duckdb(sql, params=None):
+    """
+    Runs a query against the DuckDB copy of the data and returns its rows
+    as a list of tuples.
+    """
+    connection = get_duckdb_connection()
+    try:
+        return connection.execute(sql, params or []).fetchall()
+    finally:
+        connection.close()
+
+
+def install_copy_functions(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Creates or replaces the SQL functions that the fields' copy_templates call
+    in a PostgreSQL database. Other databases are left alone.
+
+    It runs after every migrate, and before each load in case the database
+    was migrated by an older version of the app.
+    """
+    from calaccess_raw.fields import get_copy_functions
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    if not router.allow_migrate(using, 'calaccess_raw'):
+        return
+
+    with connection.cursor() as cursor:
+        # Keep loads running side by side from replacing them at the same time
+        cursor.execute("SELECT pg_advisory_lock(hashtext('calaccess_raw'))")
+        try:
+            for sql in get_copy_functions():
+                cursor.execute(sql)
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(hashtext('calaccess_raw'))")
+
+
 def get_model_list():
     """
     Returns a model list with all the data tables in this application
@@ -42,3 +197,47 @@ def get_model_list():
             models.append(model)
 
     return models
+
+
+def get_selected_model_list(tables=None, exclude_tables=None):
+    """
+    Returns the models from get_model_list named in tables, or all of them if
+    there are none, less those named in exclude_tables.
+
+    Models can be named by either their class or their database table. If
+    either list is None, the CALACCESS_TABLES or CALACCESS_EXCLUDE_TABLES
+    setting is used in its place.
+    """
+    if tables is None:
+        tables = getattr(settings, 'CALACCESS_TABLES', None)
+    if exclude_tables is None:
+        exclude_tables = getattr(settings, 'CALACCESS_EXCLUDE_TABLES', None)
+    tables = set(tables or [])
+    exclude_tables = set(exclude_tables or [])
+
+    models = get_model_list()
+    names = set(m.__name__ for m in models) | set(m._meta.db_table for m in models)
+    unknown = (tables | exclude_tables) - names
+    if unknown:
+        raise ValueError("Unknown tables: %s" % ", ".join(sorted(unknown)))
+
+    def named(model, names):
+        return model.__name__ in names or model._meta.db_table in names
+
+    if tables:
+        models = [m for m in models if named(m, tables)]
+    return [m for m in models if not named(m, exclude_tables)]
+
+
+def get_selected_tsv_names(tables=None, exclude_tables=None):
+    """
+    Returns the names of the TSV files of the models picked by
+    get_selected_model_list.
+
+    Returns None if every model is picked, so the files that don't belong
+    to any model are kept as well.
+    """
+    models = get_selected_model_list(tables, exclude_tables)
+    if len(models) == len(get_model_list()):
+        return None
+    return set(m.objects.get_tsv_name() for m in models)
@@ -26,9 +26,14 @@ class RawDataFileAdmin(BaseAdmin):
         "download_records_count",
         "clean_records_count",
         "load_records_count",
+        "clean_errors_count",
         "download_columns_count",
         "clean_columns_count",
         "load_columns_count",
+        "download_crc32",
+        "download_file_size",
+        "load_copy_duration",
+        "load_index_duration",
     )
     list_display_links = ('id', 'file_name',)
     list_filter = ("version__release_datetime",)
@@ -44,6 +49,13 @@ class RawDataCommandAdmin(BaseAdmin):
         "file_name",
         "start_datetime",
         "finish_datetime",
+        "pretty_bytes_in",
+        "pretty_bytes_out",
+        "records_count",
+        "records_per_second",
+        "cpu_time",
+        "wait_time",
+        "pretty_peak_rss",
     )
     list_display_links = ("id", "command",)
     list_filter = (
@@ -2,8 +2,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CalAccessRawConfig(AppConfig):
     name = 'calaccess_raw'
     verbose_name = "CAL-ACCESS raw data"
+
+    def ready(self):
+        """
+        Installs the SQL functions the fields' copy_templates call whenever
+        the app's tables are migrated.
+        """
+        from calaccess_raw import install_copy_functions
+        post_migrate.connect(install_copy_functions, sender=self)
@@ -4,7 +4,18 @@
 Custom field overrides that allow for cleaning and transforming the data
 when it is bulk loaded into the database with PostgreSQL's COPY command via
 django-postgres-copy.
+
+The copy_templates call SQL functions, created by each field's copy_function,
+that do the work of the inline CASE expressions in the inline_copy_templates.
+
+Each field's from_csv method applies the same transformation in Python for
+databases that are loaded row by row, and its duckdb_template does the same
+for the optional DuckDB copy of the data. Its to_csv method writes the result
+back out as text that can be copied straight into the field's column.
 """
+from decimal import Decimal
+from datetime import datetime
+from django.utils import six
 from django.db.models import fields
 from django.template.defaultfilters import capfirst
 
@@ -31,6 +42,43 @@ class CalAccessFieldMixin(fields.Field):
             return True
         return False
 
+    def get_duckdb_type(self):
+        """
+        The type of the field's column in a DuckDB database.
+        """
+        return self.duckdb_type % self.__dict__
+
+    def to_csv(self, value):
+        """
+        Transforms a raw value the same way as from_csv and returns it as text
+        the database can read straight into the field's column, with an empty
+        string standing in for null.
+
+        Values that can't be transformed are returned as they are, so loading
+        them fails just as it would have in the copy_template.
+        """
+        try:
+            value = self.from_csv(value)
+        except (ValueError, ArithmeticError):
+            return value
+        if value is None:
+            return ''
+        if isinstance(value, datetime):
+            return value.isoformat(str(' '))
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if isinstance(value, float):
+            return repr(value)
+        return six.text_type(value)
+
+    def from_normalized_csv(self, value):
+        """
+        Reads back a value written by to_csv.
+        """
+        if value == '' and self.get_internal_type() != 'CharField':
+            return None
+        return self.to_python(value)
+
 
 class DocumentCloudMixin(fields.Field):
     """
@@ -63,13 +111,26 @@ class DocumentCloudMixin(fields.Field):
 
 class CharField(fields.CharField, CalAccessFieldMixin, DocumentCloudMixin):
     copy_type = "text"
-    copy_template = """
+    copy_template = """calaccess_to_text("%(name)s")"""
+    copy_function = """
+    CREATE OR REPLACE FUNCTION calaccess_to_text(value text) RETURNS text AS $$
+        SELECT COALESCE(TRIM(value), '')
+    $$ LANGUAGE SQL IMMUTABLE
+    """
+    inline_copy_template = """
     CASE
         WHEN "%(name)s" IS NULL
             THEN ''
         ELSE TRIM("%(name)s")
     END
     """
+    duckdb_type = "VARCHAR"
+    duckdb_template = """COALESCE(TRIM("%(name)s"), '')"""
+
+    def from_csv(self, value):
+        if value is None:
+            return ''
+        return value.strip(' ')
 
     def description(self):
         return super(CharField, self).description % dict(
@@ -79,29 +140,89 @@ class CharField(fields.CharField, CalAccessFieldMixin, DocumentCloudMixin):
 
 class DateField(fields.DateField, CalAccessFieldMixin):
     copy_type = "text"
-    copy_template = """
+    copy_template = """calaccess_to_date("%(name)s")"""
+    # to_date is only STABLE, and a function is only inlined if its body is
+    # no more volatile than it is declared to be
+    copy_function = """
+    CREATE OR REPLACE FUNCTION calaccess_to_date(value text) RETURNS date AS $$
+        SELECT CASE
+            WHEN TRIM(value) != ''
+                THEN to_date(substring(value from 1 for 10), 'MM/DD/YYYY')
+        END
+    $$ LANGUAGE SQL STABLE
+    """
+    inline_copy_template = """
     CASE
         WHEN "%(name)s" IS NOT NULL AND TRIM("%(name)s") != ''
             THEN to_date(substring("%(name)s" from 1 for 10), 'MM/DD/YYYY')
         ELSE null
     END
     """
+    duckdb_type = "DATE"
+    duckdb_template = """
+    CASE
+        WHEN TRIM("%(name)s") != ''
+            THEN CAST(strptime(
+                split_part(TRIM(substr("%(name)s", 1, 10)), ' ', 1),
+                '%%m/%%d/%%Y'
+            ) AS DATE)
+    END
+    """
+
+    def from_csv(self, value):
+        if value is None or not value.strip(' '):
+            return None
+        # Like to_date, ignore whatever follows the date in the first ten characters
+        return datetime.strptime(value[:10].split()[0], '%m/%d/%Y').date()
 
 
 class DateTimeField(fields.DateTimeField, CalAccessFieldMixin):
     copy_type = "text"
-    copy_template = """
+    copy_template = """calaccess_to_timestamp("%(name)s")"""
+    # to_timestamp depends on the session's time zone, so it can only be STABLE
+    copy_function = """
+    CREATE OR REPLACE FUNCTION calaccess_to_timestamp(value text)
+    RETURNS timestamp with time zone AS $$
+        SELECT CASE
+            WHEN TRIM(value) != ''
+                THEN to_timestamp(value, 'MM/DD/YYYY HH12:MI:SS AM')
+        END
+    $$ LANGUAGE SQL STABLE
+    """
+    inline_copy_template = """
     CASE
         WHEN "%(name)s" IS NOT NULL AND TRIM("%(name)s") != ''
             THEN to_timestamp("%(name)s", 'MM/DD/YYYY HH12:MI:SS AM')
         ELSE null
     END
     """
+    duckdb_type = "TIMESTAMP"
+    duckdb_template = """
+    CASE
+        WHEN TRIM("%(name)s") != ''
+            THEN strptime(TRIM("%(name)s"), '%%m/%%d/%%Y %%I:%%M:%%S %%p')
+    END
+    """
+
+    def from_csv(self, value):
+        if value is None or not value.strip(' '):
+            return None
+        return datetime.strptime(value.strip(' '), '%m/%d/%Y %I:%M:%S %p')
 
 
 class DecimalField(fields.DecimalField, CalAccessFieldMixin):
     copy_type = "text"
-    copy_template = """
+    copy_template = """calaccess_to_numeric("%(name)s")"""
+    copy_function = """
+    CREATE OR REPLACE FUNCTION calaccess_to_numeric(value text) RETURNS numeric AS $$
+        SELECT CASE
+            WHEN value IS NULL OR value = ''
+                THEN 0.0
+            ELSE value::numeric
+        END
+    $$ LANGUAGE SQL IMMUTABLE
+    """
+    inline_copy_template = """
     CASE
         WHEN "%(name)s" = ''
             THEN 0.0
@@ -111,11 +232,34 @@ class DecimalField(fields.DecimalField, CalAccessFieldMixin):
             THEN "%(name)s"::numeric
     END
     """
+    duckdb_type = "DECIMAL(%(max_digits)s, %(decimal_places)s)"
+    duckdb_template = """
+    CASE
+        WHEN "%(name)s" IS NULL OR "%(name)s" = ''
+            THEN 0.0
+        ELSE CAST(TRIM("%(name)s") AS DECIMAL(%(max_digits)s, %(decimal_places)s))
+    END
+    """
+
+    def from_csv(self, value):
+        if not value:
+            return Decimal('0.0')
+        return Decimal(value)
 
 
 class FloatField(fields.FloatField, CalAccessFieldMixin):
     copy_type = "text"
-    copy_template = """
+    copy_template = """calaccess_to_float("%(name)s")"""
+    copy_function = """
+    CREATE OR REPLACE FUNCTION calaccess_to_float(value text) RETURNS double precision AS $$
+        SELECT CASE
+            WHEN value IS NULL OR TRIM(value) = ''
+                THEN 0.0
+            ELSE value::double precision
+        END
+    $$ LANGUAGE SQL IMMUTABLE
+    """
+    inline_copy_template = """
     CASE
         WHEN TRIM("%(name)s") = ''
             THEN 0.0
@@ -125,11 +269,38 @@ class FloatField(fields.FloatField, CalAccessFieldMixin):
             THEN "%(name)s"::double precision
     END
     """
+    duckdb_type = "DOUBLE"
+    duckdb_template = """
+    CASE
+        WHEN "%(name)s" IS NULL OR TRIM("%(name)s") = ''
+            THEN 0.0
+        ELSE CAST(TRIM("%(name)s") AS DOUBLE)
+    END
+    """
+
+    def from_csv(self, value):
+        if value is None or not value.strip(' '):
+            return 0.0
+        return float(value)
 
 
 class IntegerField(fields.IntegerField, CalAccessFieldMixin, DocumentCloudMixin):
     copy_type = "text"
-    copy_template = """
+    copy_template = """calaccess_to_int("%(name)s")"""
+    copy_function = """
+    CREATE OR REPLACE FUNCTION calaccess_to_int(value text) RETURNS integer AS $$
+        SELECT CASE
+            WHEN TRIM(value) = ''
+                THEN NULL
+            WHEN value IN ('Y', 'y', 'X', 'x')
+                THEN 1
+            WHEN value IN ('N', 'n')
+                THEN 0
+            ELSE value::int
+        END
+    $$ LANGUAGE SQL IMMUTABLE
+    """
+    inline_copy_template = """
     CASE
         WHEN TRIM("%(name)s") = ''
             THEN NULL
@@ -153,3 +324,47 @@ class IntegerField(fields.IntegerField, CalAccessFieldMixin, DocumentCloudMixin)
             THEN "%(name)s"::int
         ELSE NULL
     END"""
+    duckdb_type = "INTEGER"
+    duckdb_template = """
+    CASE
+        WHEN TRIM("%(name)s") = ''
+            THEN NULL
+        WHEN "%(name)s" IN ('Y', 'y', 'X', 'x')
+            THEN 1
+        WHEN "%(name)s" IN ('N', 'n')
+            THEN 0
+        ELSE CAST(TRIM("%(name)s") AS INTEGER)
+    END
+    """
+    # Values the copy_template swaps out before casting to an integer
+    copy_values = {
+        'Y': 1,
+        'y': 1,
+        'X': 1,
+        'x': 1,
+        'N': 0,
+        'n': 0,
+    }
+
+    def from_csv(self, value):
+        if value is None or not value.strip(' '):
+            return None
+        if value in self.copy_values:
+            return self.copy_values[value]
+        return int(value)
+
+
+def get_copy_functions():
+    """
+    Returns the SQL that creates each of the functions the copy_templates call.
+    """
+    return [
+        f.copy_function for f in (
+            CharField,
+            DateField,
+            DateTimeField,
+            DecimalField,
+            FloatField,
+            IntegerField,
+        )
+    ]
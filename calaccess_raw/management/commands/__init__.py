@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+from __future__ import division
+import os
 import sys
+import time
 import codecs
 import locale
 import requests
+import threading
 from re import sub
-from datetime import datetime
+from datetime import datetime, timedelta
 from email.utils import parsedate
 from django.utils import timezone
 from django.utils.six.moves import input
@@ -16,6 +20,43 @@ from calaccess_raw.models.tracking import (
     RawDataFile,
     RawDataCommand
 )
+try:
+    import resource
+except ImportError:
+    # Windows doesn't have it, so peak memory use isn't recorded there
+    resource = None
+
+
+def get_cpu_time():
+    """
+    Returns the seconds of CPU time used so far by this process and the child
+    processes it has waited on.
+
+    In a thread other than the main one, only that thread's time is counted
+    where Python can measure it, so loads running side by side in a pool of
+    threads each get their own.
+    """
+    if hasattr(time, 'thread_time') and threading.current_thread().name != 'MainThread':
+        return time.thread_time()
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def get_peak_rss():
+    """
+    Returns the most bytes of memory held at once by this process or any
+    child process it has waited on, or None if that can't be measured.
+    """
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # macOS counts in bytes and everything else in kilobytes
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
 
 
 class CalAccessCommand(BaseCommand):
@@ -24,6 +65,9 @@ class CalAccessCommand(BaseCommand):
     for the other commands in this application.
     """
     url = 'http://campaignfinance.cdn.sos.ca.gov/dbwebexport.zip'
+    # The log record of the command running this one, if it was handed over
+    # by calaccess_raw.pipeline.run_command
+    caller_log = None
 
     def handle(self, *args, **options):
         """
@@ -39,6 +83,7 @@ class CalAccessCommand(BaseCommand):
 
         # Start the clock
         self.start_datetime = datetime.now()
+        self.start_cpu_time = get_cpu_time()
 
         # Set the logger models for later use
         self.raw_data_versions = RawDataVersion.objects
@@ -56,7 +101,8 @@ class CalAccessCommand(BaseCommand):
         dt = datetime(*parsedate(last_modified)[:6])
         return {
             'content-length': int(request.headers['content-length']),
-            'last-modified': timezone.utc.localize(dt)
+            'last-modified': timezone.utc.localize(dt),
+            'accept-ranges': request.headers.get('accept-ranges', 'none'),
         }
 
     def get_last_log(self, file_name=None, finished=False):
@@ -94,6 +140,9 @@ class CalAccessCommand(BaseCommand):
         If the command was called by another command, return the caller's
         RawDataCommandLog object. Else, return None.
         """
+        if self.caller_log:
+            return self.caller_log
+
         caller = None
 
         if not self._called_from_command_line:
@@ -156,6 +205,23 @@ class CalAccessCommand(BaseCommand):
         duration = datetime.now() - self.start_datetime
         self.stdout.write('Duration: {}'.format(str(duration)))
 
+    def record_metrics(self, log_record, bytes_in=None, bytes_out=None, records_count=None):
+        """
+        Sets how much data the command handled and the time and memory it took
+        on its RawDataCommand record, which is left for the caller to save.
+        """
+        elapsed = datetime.now() - self.start_datetime
+        cpu_time = timedelta(seconds=get_cpu_time() - self.start_cpu_time)
+        log_record.bytes_in = bytes_in
+        log_record.bytes_out = bytes_out
+        log_record.records_count = records_count
+        if records_count is not None and elapsed.total_seconds():
+            log_record.records_per_second = records_count / elapsed.total_seconds()
+        log_record.cpu_time = cpu_time
+        # CPU time of workers running side by side can add up to more than has passed
+        log_record.wait_time = max(elapsed - cpu_time, timedelta(0))
+        log_record.peak_rss = get_peak_rss()
+
     def confirm_proceed(self, prompt):
         """
         Prompts the user for yes/no confirmation to proceed.
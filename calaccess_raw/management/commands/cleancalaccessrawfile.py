@@ -3,17 +3,552 @@
 from __future__ import unicode_literals
 import os
 import csv
+import shutil
+import zipfile
+import multiprocessing
 from datetime import datetime
 from io import StringIO
 from django.utils import six
 from csvkit import CSVKitReader, CSVKitWriter
-from calaccess_raw import get_download_directory
+from calaccess_raw import (
+    get_model_list,
+    get_download_directory,
+    get_csv_compression,
+    get_csv_extension,
+    open_csv,
+    write_manifest
+)
+from django.core.management.base import CommandError
 from calaccess_raw.management.commands import CalAccessCommand
 from calaccess_raw.models.tracking import RawDataVersion
 
+# A translate table that swaps null bytes for spaces in one pass. On Python 2
+# it also swaps non-ASCII bytes for question marks, as clean_lines does.
+CONTROL_BYTES_TABLE = bytearray(range(256))
+CONTROL_BYTES_TABLE[0] = ord(' ')
+if six.PY2:
+    CONTROL_BYTES_TABLE[128:] = b'?' * 128
+CONTROL_BYTES_TABLE = bytes(CONTROL_BYTES_TABLE)
+
+# The ASCII 26 "substitute character," which the translate call deletes
+SUBSTITUTE_BYTES = b'\x1a'
+
+# The most lines a record broken up by line breaks in its values is joined from
+REPAIR_WINDOW = 5
+
+
+class LineRepairer(object):
+    """
+    Sorts out the lines of a source TSV file that don't split into the
+    expected number of fields.
+
+    Lines the CSVKitReader can't fix are most often records broken in two
+    by a line break inside one of their values. Short lines are held and
+    joined with the lines that follow until they add up to a whole record,
+    across no more than window lines. A window of 1 turns this off.
+    """
+    def __init__(self, headers_count, window=1):
+        self.headers_count = headers_count
+        self.window = window
+        # Short lines waiting to be joined, as (line, crlf) pairs
+        self.held = []
+
+    def parse(self, line, crlf):
+        """
+        Returns the fields of a line as read by the CSVKitReader.
+        """
+        return next(CSVKitReader(
+            StringIO(line + '\r\n' if crlf else line),
+            delimiter=str('\t')
+        ))
+
+    def feed(self, line, crlf):
+        """
+        Takes the next line, less its Windows line ending if crlf is set.
+
+        Returns a list of (fields, parsed) pairs, in order, for the rows the
+        line completes and the lines given up on, which have parsed unset.
+        """
+        results = []
+        lines = [(line, crlf)]
+        while lines:
+            line, crlf = lines.pop(0)
+
+            if self.held:
+                # Put back the line break between the pieces of the record
+                pieces = self.held + [(line, crlf)]
+                joined = ''.join(text + ('\n' if crlf else '') for text, crlf in pieces[:-1])
+                csv_field_list = (joined + line).split('\t')
+                if len(csv_field_list) == self.headers_count:
+                    self.held = []
+                    results.append((self.fix_returns(csv_field_list), True))
+                elif len(csv_field_list) < self.headers_count and len(pieces) < self.window:
+                    self.held.append((line, crlf))
+                else:
+                    # Give up on the first piece and start over from the next
+                    results.append((self.parse(*self.held[0]), False))
+                    lines = pieces[1:] + lines
+                    self.held = []
+                continue
+
+            csv_field_list = line.split('\t')
+            if len(csv_field_list) == self.headers_count:
+                results.append((self.fix_returns(csv_field_list), True))
+                continue
+            short = len(csv_field_list) < self.headers_count
+
+            csv_field_list = self.parse(line, crlf)
+            if len(csv_field_list) == self.headers_count:
+                results.append((self.fix_returns(csv_field_list), True))
+            elif short and self.window > 1:
+                self.held.append((line, crlf))
+            else:
+                results.append((csv_field_list, False))
+        return results
+
+    def flush(self):
+        """
+        Gives up on the lines still held once the file has run out.
+
+        Returns the same list of pairs as feed.
+        """
+        results = []
+        while self.held:
+            held = self.held
+            self.held = []
+            results.append((self.parse(*held[0]), False))
+            for line, crlf in held[1:]:
+                results.extend(self.feed(line, crlf))
+        return results
+
+    def fix_returns(self, csv_field_list):
+        """
+        Swaps carriage returns in the fields for line breaks, as
+        CSVKitWriter.writerow does but writerows does not.
+        """
+        return [f.replace('\r', '\n') for f in csv_field_list]
+
+
+def clean_lines(tsv_lines, headers_count, csv_writer, repairer=None, flush=True):
+    """
+    Cleans lines from a source TSV file and writes them out as CSV rows.
+
+    Lines that don't split into the expected number of fields are handed to
+    the repairer, a LineRepairer, which leaves the lines it holds at the end
+    for the next call unless flush is set.
+
+    Returns a tuple with the number of rows written, the number of lines
+    read and a list of the lines that could not be parsed.
+    """
+    if repairer is None:
+        repairer = LineRepairer(headers_count)
+    rows_count = 0
+    lines_count = 0
+    log_rows = []
+
+    for tsv_line in tsv_lines:
+        lines_count += 1
+
+        # Goofing around with the encoding while we're in there.
+        tsv_line = tsv_line.decode("ascii", "replace")
+        if six.PY2:
+            tsv_line = tsv_line.replace('\ufffd', '?')
+
+        # Nuke any null bytes
+        null_bytes = tsv_line.count('\x00')
+        if null_bytes:
+            tsv_line = tsv_line.replace('\x00', ' ')
+
+        # Nuke ASCII 26 char, the "substitute character"
+        # or chr(26) in python
+        sub_char = tsv_line.count('\x1a')
+        if sub_char:
+            tsv_line = tsv_line.replace('\x1a', '')
+
+        # Split on tabs so we can later spit it back out as CSV
+        # and remove extra newlines while we are there.
+        csv_field_list = tsv_line.replace("\r\n", "").split("\t")
+
+        # Check if our values line up with our headers
+        # and if not, see if CSVkit or the repairer can sort out the problems
+        if repairer.held or not len(csv_field_list) == headers_count:
+            results = repairer.feed(
+                tsv_line.replace("\r\n", ""),
+                tsv_line.endswith("\r\n")
+            )
+        else:
+            results = [(csv_field_list, True)]
+
+        for csv_field_list, parsed in results:
+            if not parsed:
+                log_rows.append([
+                    rows_count + 1,
+                    headers_count,
+                    len(csv_field_list),
+                    ','.join(csv_field_list)
+                ])
+                continue
+
+            # Write out the row
+            csv_writer.writerow(csv_field_list)
+            rows_count += 1
+
+    if flush:
+        for csv_field_list, parsed in repairer.flush():
+            log_rows.append([
+                rows_count + 1,
+                headers_count,
+                len(csv_field_list),
+                ','.join(csv_field_list)
+            ])
+
+    return rows_count, lines_count, log_rows
+
+
+def clean_blocks(tsv_blocks, headers_count, csv_writer, repairer=None, flush=True):
+    """
+    A faster take on clean_lines that works through large blocks of bytes
+    that end at line breaks instead of one line at a time.
+
+    Control characters are swapped out of each block with a single
+    translate call and the block is decoded in one go. Only lines that
+    don't split into the expected number of fields fall back to the
+    CSVKitReader and the repairer.
+
+    Writes exactly what clean_lines would and returns the same tuple.
+    """
+    if repairer is None:
+        repairer = LineRepairer(headers_count)
+    rows_count = 0
+    lines_count = 0
+    log_rows = []
+
+    for block in tsv_blocks:
+        # A last line without a line break takes the slow path
+        tail = b''
+        if not block.endswith(b'\n'):
+            cut = block.rfind(b'\n') + 1
+            block, tail = block[:cut], block[cut:]
+
+        text = block.translate(CONTROL_BYTES_TABLE, SUBSTITUTE_BYTES)
+        text = text.decode("ascii", "replace")
+        lines = text.split('\n')
+        # The block ends with a line break, so this is always empty
+        lines.pop()
+        lines_count += len(lines)
+
+        rows = []
+        for line in lines:
+            # Drop the Windows line ending, or put back the line break
+            # the split took off, the same as clean_lines
+            crlf = line[-1:] == '\r'
+            if crlf:
+                line = line[:-1]
+            else:
+                line += '\n'
+
+            csv_field_list = line.split('\t')
+
+            if repairer.held or not len(csv_field_list) == headers_count:
+                for csv_field_list, parsed in repairer.feed(line, crlf):
+                    if not parsed:
+                        log_rows.append([
+                            rows_count + 1,
+                            headers_count,
+                            len(csv_field_list),
+                            ','.join(csv_field_list)
+                        ])
+                        continue
+                    rows.append(csv_field_list)
+                    rows_count += 1
+                continue
+            elif '\r' in line:
+                # CSVKitWriter.writerow does this, but writerows does not
+                csv_field_list = [f.replace('\r', '\n') for f in csv_field_list]
+
+            rows.append(csv_field_list)
+            rows_count += 1
+
+        csv_writer.writerows(rows)
+
+        if tail:
+            tail_rows, tail_lines, tail_log = clean_lines(
+                [tail],
+                headers_count,
+                csv_writer,
+                repairer,
+                flush=False
+            )
+            for row in tail_log:
+                row[0] += rows_count
+            log_rows.extend(tail_log)
+            rows_count += tail_rows
+            lines_count += tail_lines
+
+    if flush:
+        for csv_field_list, parsed in repairer.flush():
+            log_rows.append([
+                rows_count + 1,
+                headers_count,
+                len(csv_field_list),
+                ','.join(csv_field_list)
+            ])
+
+    return rows_count, lines_count, log_rows
+
+
+def read_blocks(tsv_file, end=None, block_size=8 * 1024 * 1024):
+    """
+    Yields blocks of bytes from the current position of a file up to the
+    end offset, or the end of the file if there is none.
+
+    Every block ends with a line break, except the last if the file does not.
+    """
+    # Streams out of a ZIP archive can't always report their position
+    position = tsv_file.tell() if end is not None else 0
+    remainder = b''
+    while end is None or position < end:
+        if end is not None:
+            block_size = min(block_size, end - position)
+        block = tsv_file.read(block_size)
+        if not block:
+            break
+        position += len(block)
+        block = remainder + block
+        cut = block.rfind(b'\n') + 1
+        remainder = block[cut:]
+        if cut:
+            yield block[:cut]
+    if remainder:
+        yield remainder
+
+
+def read_headers(tsv_file):
+    """
+    Reads the first line of a source TSV file and returns its headers as
+    a list, or None if the file is empty.
+    """
+    headers = tsv_file.readline().decode("ascii", "replace")
+    headers_csv = CSVKitReader(StringIO(headers), delimiter=str('\t'))
+    try:
+        return next(headers_csv)
+    except StopIteration:
+        return None
+
+
+def get_zip_members(zip_path):
+    """
+    Returns the TSV files in a CAL-ACCESS ZIP archive as a dictionary of
+    ZipInfo objects keyed by file name.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        return dict(
+            (member.filename.split('/')[-1], member)
+            for member in zf.infolist()
+            if member.filename.upper().endswith('.TSV')
+        )
+
+
+def open_zip_member(zip_path, file_name):
+    """
+    Opens a TSV file inside a CAL-ACCESS ZIP archive for reading in binary
+    mode, wherever it sits among the archive's folders.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        for member in zf.infolist():
+            if member.filename.split('/')[-1].upper() == file_name.upper():
+                # The member keeps its own handle on the archive after it closes
+                return zf.open(member)
+    raise KeyError("There is no item named %r in the archive" % file_name)
+
+
+def write_error_log(log_path, rows):
+    """
+    Writes the lines that could not be parsed out to a CSV file.
+    """
+    # Make sure the log directory exists
+    log_dir = os.path.dirname(log_path)
+    os.path.exists(log_dir) or os.makedirs(log_dir)
+
+    with open(log_path, 'w') as log_file:
+        log_writer = CSVKitWriter(log_file, quoting=csv.QUOTE_ALL)
+
+        # Add the headers
+        log_writer.writerow([
+            'Line number',
+            'Headers len',
+            'Fields len',
+            'Line value'
+        ])
+
+        # Log out the rows
+        log_writer.writerows(rows)
+
+
+def memoize(func, max_size=100000):
+    """
+    Wraps a function of one value in a cache of its results.
+    """
+    cache = {}
+
+    def memoized(value):
+        try:
+            return cache[value]
+        except KeyError:
+            if len(cache) >= max_size:
+                cache.clear()
+            result = cache[value] = func(value)
+            return result
+    return memoized
+
+
+def get_normalizers(file_name, headers):
+    """
+    Returns a list with a function for each header that normalizes its
+    values with the to_csv method of the model's field.
+
+    Returns None if no model is loaded from the file.
+    """
+    db_table = file_name.upper().replace('.TSV', '')
+    models = [m for m in get_model_list() if m._meta.db_table == db_table]
+    if not models:
+        return None
+
+    fields = dict((f.db_column, f) for f in models[0]._meta.fields)
+    normalizers = []
+    for h in headers:
+        field = fields.get(h)
+        if not hasattr(field, 'to_csv'):
+            normalizers.append(six.text_type)
+        elif field.get_internal_type() in ('DateField', 'DateTimeField'):
+            # The same few thousand dates turn up millions of times
+            normalizers.append(memoize(field.to_csv))
+        else:
+            normalizers.append(field.to_csv)
+    return normalizers
+
+
+class NormalizingWriter(object):
+    """
+    Wraps a CSV writer to normalize the values of each row on its way out.
+    """
+    def __init__(self, csv_writer, normalizers):
+        self.csv_writer = csv_writer
+        self.normalizers = normalizers
+
+    def writerow(self, row):
+        self.csv_writer.writerow([
+            normalize(value) for normalize, value in zip(self.normalizers, row)
+        ])
+
+    def writerows(self, rows):
+        normalizers = self.normalizers
+        self.csv_writer.writerows([
+            [normalize(value) for normalize, value in zip(normalizers, row)]
+            for row in rows
+        ])
+
+
+class CleanedStream(object):
+    """
+    A read-only file-like object that cleans a source TSV file as it is
+    read, returning the same CSV the clean command would write to disk.
+
+    Once it has been read to the end, the rows_count, lines_count and
+    log_rows attributes hold the same totals clean_blocks returns.
+    """
+    def __init__(self, tsv_file, headers_list, repair_window=REPAIR_WINDOW):
+        self.blocks = read_blocks(tsv_file)
+        self.headers_count = len(headers_list)
+        self.repairer = LineRepairer(self.headers_count, repair_window)
+        self.finished = False
+        self.buffer = six.StringIO()
+        self.csv_writer = CSVKitWriter(self.buffer, quoting=csv.QUOTE_ALL)
+        self.csv_writer.writerow(headers_list)
+        self.pending = six.StringIO()
+        self.rows_count = 0
+        self.lines_count = 0
+        self.log_rows = []
+
+    def read(self, size=-1):
+        """
+        Returns up to size characters of cleaned CSV, or all that remain.
+        """
+        chunks = []
+        length = 0
+        while size < 0 or length < size:
+            chunk = self.pending.read(-1 if size < 0 else size - length)
+            if not chunk:
+                if not self.refill():
+                    break
+                continue
+            chunks.append(chunk)
+            length += len(chunk)
+        return ''.join(chunks)
+
+    def refill(self):
+        """
+        Cleans the next block of the TSV file into the pending buffer.
+
+        Returns False once the file has run out.
+        """
+        while not self.buffer.tell():
+            if self.finished:
+                return False
+            try:
+                blocks = [next(self.blocks)]
+            except StopIteration:
+                # One last pass to give up on any lines still held for repair
+                blocks = []
+                self.finished = True
+            rows_count, lines_count, log_rows = clean_blocks(
+                blocks,
+                self.headers_count,
+                self.csv_writer,
+                self.repairer,
+                flush=self.finished
+            )
+            for row in log_rows:
+                row[0] += self.rows_count
+            self.log_rows.extend(log_rows)
+            self.rows_count += rows_count
+            self.lines_count += lines_count
+
+        self.pending = six.StringIO(self.buffer.getvalue())
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return True
+
+
+def clean_shard(args):
+    """
+    Cleans a byte range of a source TSV file into its own CSV file from
+    within a worker process.
+    """
+    tsv_path, start, end, headers, csv_path, compression, normalize, repair_window = args
+    headers_count = len(headers)
+    csv.field_size_limit(1000000000)
+    with open(tsv_path, 'rb') as tsv_file:
+        with open_csv(csv_path, 'w', compression=compression) as csv_file:
+            tsv_file.seek(start)
+            csv_writer = CSVKitWriter(csv_file, quoting=csv.QUOTE_ALL)
+            if normalize:
+                csv_writer = NormalizingWriter(
+                    csv_writer,
+                    get_normalizers(os.path.basename(tsv_path), headers)
+                )
+            return clean_blocks(
+                read_blocks(tsv_file, end),
+                headers_count,
+                csv_writer,
+                LineRepairer(headers_count, repair_window)
+            )
+
 
 class Command(CalAccessCommand):
     help = 'Clean a source CAL-ACCESS TSV file and reformat it as a CSV'
+    # The smallest number of bytes worth handing to its own worker
+    min_shard_size = 32 * 1024 * 1024
 
     def add_arguments(self, parser):
         """
@@ -31,6 +566,39 @@ class Command(CalAccessCommand):
             default=False,
             help="Keep original TSV file"
         )
+        parser.add_argument(
+            "--from-zip",
+            action="store_true",
+            dest="from_zip",
+            default=False,
+            help="Read the TSV file straight out of the downloaded ZIP "
+                 "archive instead of the tsv directory"
+        )
+        parser.add_argument(
+            "--normalize",
+            action="store_true",
+            dest="normalize",
+            default=False,
+            help="Write dates, numbers and text the way they will be loaded, so "
+                 "PostgreSQL can copy them straight into the model's table"
+        )
+        parser.add_argument(
+            "--shards",
+            action="store",
+            type=int,
+            dest="shards",
+            default=1,
+            help="Number of pieces of the TSV file to clean in parallel processes"
+        )
+        parser.add_argument(
+            "--repair-window",
+            action="store",
+            type=int,
+            dest="repair_window",
+            default=REPAIR_WINDOW,
+            help="Most lines to join back into a record broken up by line "
+                 "breaks in its values (1 turns off the repair)"
+        )
 
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
@@ -41,6 +609,15 @@ class Command(CalAccessCommand):
         self.tsv_dir = os.path.join(self.data_dir, "tsv/")
         self.csv_dir = os.path.join(self.data_dir, "csv/")
         self.log_dir = os.path.join(self.data_dir, "log/")
+        self.zip_path = os.path.join(self.data_dir, 'calaccess.zip')
+        self.from_zip = options['from_zip']
+        self.normalize = options['normalize']
+        self.shards = max(options['shards'], 1)
+        self.repair_window = max(options['repair_window'], 1)
+        # Worker processes in a pool can't start processes of their own,
+        # and a compressed stream can't be split up without inflating it all
+        if multiprocessing.current_process().daemon or self.from_zip:
+            self.shards = 1
 
         if self.verbosity > 2:
             self.log(" Cleaning %s" % self.file_name)
@@ -75,11 +652,17 @@ class Command(CalAccessCommand):
         self.clean(options['file_name'])
 
         # unless keeping files, remove tsv files
-        if not options['keep_files']:
+        if not options['keep_files'] and not self.from_zip:
             os.remove(os.path.join(self.tsv_dir, options['file_name']))
 
         if self.version:
             # save the log record
+            self.record_metrics(
+                self.log_record,
+                bytes_in=self.bytes_in,
+                bytes_out=self.bytes_out,
+                records_count=self.records_count,
+            )
             self.log_record.finish_datetime = datetime.now()
             self.log_record.save()
 
@@ -91,86 +674,70 @@ class Command(CalAccessCommand):
         # Up the CSV data limit
         csv.field_size_limit(1000000000)
 
+        # How much was read, written and kept, for the log record
+        self.bytes_in = None
+        self.bytes_out = None
+        self.records_count = None
+
         # Input and output paths
         tsv_path = os.path.join(self.tsv_dir, self.file_name)
         csv_path = os.path.join(
             self.csv_dir,
-            self.file_name.lower().replace("tsv", "csv")
+            self.file_name.lower().replace(".tsv", get_csv_extension())
         )
 
         # Reader
-        tsv_file = open(tsv_path, 'rb')
+        if self.from_zip:
+            try:
+                tsv_file = open_zip_member(self.zip_path, self.file_name)
+            except (IOError, KeyError) as e:
+                raise CommandError("Can't read %s from %s: %s" % (
+                    self.file_name,
+                    self.zip_path,
+                    e
+                ))
+        else:
+            tsv_file = open(tsv_path, 'rb')
 
         # Writer
-        csv_file = open(csv_path, 'w')
+        csv_file = open_csv(csv_path, 'w')
         csv_writer = CSVKitWriter(csv_file, quoting=csv.QUOTE_ALL)
 
         # Pull and clean the headers
-        try:
-            headers = tsv_file.readline()
-        except StopIteration:
-            return
-        headers = headers.decode("ascii", "replace")
-        headers_csv = CSVKitReader(StringIO(headers), delimiter=str('\t'))
-        try:
-            headers_list = next(headers_csv)
-        except StopIteration:
+        headers_list = read_headers(tsv_file)
+        if headers_list is None:
             return
         headers_count = len(headers_list)
         csv_writer.writerow(headers_list)
 
-        log_rows = []
+        # Normalize the values for the model loaded from the file, if there is one
+        normalizers = self.normalize and get_normalizers(self.file_name, headers_list)
+        if normalizers:
+            csv_writer = NormalizingWriter(csv_writer, normalizers)
 
         # Loop through the rest of the data
-        line_number = 1
-        for tsv_line in tsv_file:
-
-            # Goofing around with the encoding while we're in there.
-            tsv_line = tsv_line.decode("ascii", "replace")
-            if six.PY2:
-                tsv_line = tsv_line.replace('\ufffd', '?')
-
-            # Nuke any null bytes
-            null_bytes = tsv_line.count('\x00')
-            if null_bytes:
-                tsv_line = tsv_line.replace('\x00', ' ')
-
-            # Nuke ASCII 26 char, the "substitute character"
-            # or chr(26) in python
-            sub_char = tsv_line.count('\x1a')
-            if sub_char:
-                tsv_line = tsv_line.replace('\x1a', '')
-
-            # Split on tabs so we can later spit it back out as CSV
-            # and remove extra newlines while we are there.
-            csv_field_list = tsv_line.replace("\r\n", "").split("\t")
-
-            # Check if our values line up with our headers
-            # and if not, see if CSVkit can sort out the problems
-            if not len(csv_field_list) == headers_count:
-                csv_field_list = next(CSVKitReader(
-                    StringIO(tsv_line),
-                    delimiter=str('\t')
-                ))
-                if not len(csv_field_list) == headers_count:
-                    if self.verbosity > 2:
-                        msg = '  Bad parse of line %s (%s headers, %s values)'
-                        self.failure(msg % (
-                            line_number,
-                            len(headers_list),
-                            len(csv_field_list)
-                        ))
-                    log_rows.append([
-                        line_number,
-                        len(headers_list),
-                        len(csv_field_list),
-                        ','.join(csv_field_list)
-                    ])
-                    continue
+        if self.shards > 1:
+            # Finish the header so that compressed parts can be appended after it
+            csv_file.close()
+            rows_count, lines_count, log_rows = self.clean_shards(
+                tsv_path,
+                tsv_file.tell(),
+                headers_list,
+                csv_path,
+                bool(normalizers)
+            )
+        else:
+            rows_count, lines_count, log_rows = clean_blocks(
+                read_blocks(tsv_file),
+                headers_count,
+                csv_writer,
+                LineRepairer(headers_count, self.repair_window)
+            )
 
-            # Write out the row
-            csv_writer.writerow(csv_field_list)
-            line_number += 1
+        if self.verbosity > 2:
+            msg = '  Bad parse of line %s (%s headers, %s values)'
+            for row in log_rows:
+                self.failure(msg % tuple(row[:3]))
 
         # Log errors if there are any
         if log_rows:
@@ -187,38 +754,112 @@ class Command(CalAccessCommand):
 
             # add download counts to raw_file_record
             raw_file.download_columns_count = headers_count
-            raw_file.download_records_count = line_number
+            raw_file.download_records_count = lines_count
+            raw_file.clean_errors_count = len(log_rows)
             raw_file.save()
 
         # Shut it down
         tsv_file.close()
         csv_file.close()
 
+        # Describe the file so that loading it doesn't need to scan it again
+        write_manifest(csv_path, headers_list, rows_count, normalized=bool(normalizers))
+
+        if self.from_zip:
+            self.bytes_in = get_zip_members(self.zip_path)[self.file_name].file_size
+        else:
+            self.bytes_in = os.path.getsize(tsv_path)
+        self.bytes_out = os.path.getsize(csv_path)
+        self.records_count = rows_count
+
+    def get_shards(self, tsv_path, start, headers_count):
+        """
+        Returns a list of (start, end) byte ranges that split the file after
+        the start offset into pieces that each begin at the start of a line.
+        """
+        end = os.path.getsize(tsv_path)
+        count = min(self.shards, (end - start) // self.min_shard_size + 1)
+
+        offsets = [start]
+        with open(tsv_path, 'rb') as tsv_file:
+            for i in range(1, count):
+                # Move ahead to the start of the next line
+                tsv_file.seek(start + (end - start) * i // count - 1)
+                tsv_file.readline()
+                if self.repair_window > 1:
+                    # The repairer holds no lines after one with all the
+                    # fields, so start there to keep broken records whole
+                    while True:
+                        line = tsv_file.readline()
+                        if not line or line.count(b'\t') + 1 == headers_count:
+                            break
+                offset = tsv_file.tell()
+                if offsets[-1] < offset < end:
+                    offsets.append(offset)
+        offsets.append(end)
+
+        return list(zip(offsets[:-1], offsets[1:]))
+
+    def clean_shards(self, tsv_path, start, headers, csv_path, normalize=False):
+        """
+        Cleans pieces of the TSV file in parallel worker processes and
+        stitches their output onto the end of the CSV file in order.
+
+        Returns the same tuple of totals as clean_lines.
+        """
+        shards = self.get_shards(tsv_path, start, len(headers))
+        # Compressed parts are concatenated as is, which gzip and zstd both allow
+        compression = get_csv_compression()
+        part_paths = [
+            '%s.%s.part' % (csv_path, i) for i in range(len(shards))
+        ]
+
+        pool = multiprocessing.Pool(processes=len(shards))
+        try:
+            results = pool.map(clean_shard, [
+                (
+                    tsv_path,
+                    shard_start,
+                    shard_end,
+                    headers,
+                    part_path,
+                    compression,
+                    normalize,
+                    self.repair_window,
+                )
+                for (shard_start, shard_end), part_path in zip(shards, part_paths)
+            ])
+
+            rows_count = 0
+            lines_count = 0
+            log_rows = []
+            with open(csv_path, 'ab') as csv_file:
+                for part_path, (part_rows, part_lines, part_log) in zip(part_paths, results):
+                    with open(part_path, 'rb') as part_file:
+                        shutil.copyfileobj(part_file, csv_file)
+                    # Line numbers in the log count rows written across all shards
+                    for row in part_log:
+                        row[0] += rows_count
+                    log_rows.extend(part_log)
+                    rows_count += part_rows
+                    lines_count += part_lines
+        finally:
+            pool.terminate()
+            pool.join()
+            for part_path in part_paths:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+
+        return rows_count, lines_count, log_rows
+
     def log_errors(self, rows):
         """
         Log any errors to a csv file
         """
-        # Make sure the log directory exists
-        os.path.exists(self.log_dir) or os.makedirs(self.log_dir)
-
-        # Log writer
-        log_path = os.path.join(
-            self.log_dir,
-            self.file_name.lower().replace("tsv", "errors.csv")
+        write_error_log(
+            os.path.join(
+                self.log_dir,
+                self.file_name.lower().replace("tsv", "errors.csv")
+            ),
+            rows
         )
-        log_file = open(log_path, 'w')
-        log_writer = CSVKitWriter(log_file, quoting=csv.QUOTE_ALL)
-
-        # Add the headers
-        log_writer.writerow([
-            'Line number',
-            'Headers len',
-            'Fields len',
-            'Line value'
-        ])
-
-        # Log out the rows
-        log_writer.writerows(rows)
-
-        # Shut it down
-        log_file.close()
@@ -2,15 +2,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import os
+import json
 import shutil
 import zipfile
 import requests
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 from hurry.filesize import size
 from clint.textui import progress
-from django.db.utils import IntegrityError
 from django.utils.timezone import utc
-from calaccess_raw import get_download_directory
+from calaccess_raw import get_download_directory, get_selected_tsv_names
 from django.template.loader import render_to_string
 from django.core.management.base import CommandError
 from calaccess_raw.management.commands import CalAccessCommand
@@ -18,8 +21,30 @@ from django.contrib.humanize.templatetags.humanize import naturaltime
 from calaccess_raw.models.tracking import RawDataVersion
 
 
+def extract_member(args):
+    """
+    Inflates a member of the ZIP archive to a file from within a worker
+    process, with its own handle on the archive.
+
+    Returns the member's name and size and how long it took.
+    """
+    zip_path, member_name, target_path = args
+    start = datetime.now()
+    with zipfile.ZipFile(zip_path) as zf:
+        member = zf.getinfo(member_name)
+        with zf.open(member) as source, open(target_path, 'wb') as target:
+            shutil.copyfileobj(source, target, Command.chunk_size)
+    return member_name, member.file_size, datetime.now() - start
+
+
 class Command(CalAccessCommand):
     help = "Download, unzip and prep the latest CAL-ACCESS database ZIP"
+    # Bytes requested from the server in each read of the stream
+    chunk_size = 1024 * 1024
+    # Bytes a segment downloads between saves of its progress to disk
+    checkpoint_size = 16 * 1024 * 1024
+    # Where the TSV files sit inside the ZIP
+    zip_data_dir = 'CalAccess/DATA/CalAccess/DATA/'
 
     def add_arguments(self, parser):
         """
@@ -48,6 +73,57 @@ class Command(CalAccessCommand):
             default=False,
             help="Force re-start (overrides auto-resume)."
         )
+        parser.add_argument(
+            "--connections",
+            action="store",
+            type=int,
+            dest="connections",
+            default=1,
+            help="Number of byte ranges of the ZIP to download concurrently"
+        )
+        parser.add_argument(
+            "--unzip-workers",
+            action="store",
+            type=int,
+            dest="unzip_workers",
+            default=1,
+            help="Number of processes that unzip files at the same time"
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            dest="incremental",
+            default=False,
+            help="Skip unzipping files unchanged since the previously loaded version"
+        )
+        parser.add_argument(
+            "--skip-unzip",
+            action="store_true",
+            dest="skip_unzip",
+            default=False,
+            help="Leave the TSV files in the ZIP archive to be cleaned "
+                 "straight out of it"
+        )
+        parser.add_argument(
+            "--tables",
+            action="store",
+            nargs="+",
+            dest="tables",
+            default=None,
+            metavar="TABLE",
+            help="Unzip only the files of these models, named by model or "
+                 "table (defaults to the CALACCESS_TABLES setting)"
+        )
+        parser.add_argument(
+            "--exclude-tables",
+            action="store",
+            nargs="+",
+            dest="exclude_tables",
+            default=None,
+            metavar="TABLE",
+            help="Leave the files of these models in the archive (defaults to "
+                 "the CALACCESS_EXCLUDE_TABLES setting)"
+        )
 
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
@@ -59,13 +135,27 @@ class Command(CalAccessCommand):
 
         # downloaded zip file will go in data_dir
         self.zip_path = os.path.join(self.data_dir, 'calaccess.zip')
+        # progress of a segmented download is tracked alongside it
+        self.segments_path = self.zip_path + '.segments'
+        self.connections = max(options['connections'], 1)
+        self.unzip_workers = max(options['unzip_workers'], 1)
+        self.incremental = options['incremental']
         # raw tsv files go in same data_dir in tsv/
         self.tsv_dir = os.path.join(self.data_dir, "tsv/")
+        # only the files of these tables are unzipped, unless it's None
+        try:
+            self.tsv_names = get_selected_tsv_names(
+                options['tables'],
+                options['exclude_tables']
+            )
+        except ValueError as e:
+            raise CommandError(e)
 
         download_metadata = self.get_download_metadata()
 
         self.current_release_datetime = download_metadata['last-modified']
         self.current_release_size = download_metadata['content-length']
+        self.accept_ranges = download_metadata['accept-ranges'] == 'bytes'
 
         self.last_started_download = self.get_last_log()
         self.last_finished_download = self.get_last_log(finished=True)
@@ -87,7 +177,7 @@ class Command(CalAccessCommand):
 
         if self.resume_download:
             # set current size to partially downloaded zip
-            self.local_file_size = os.path.getsize(self.zip_path)
+            self.local_file_size = self.get_local_file_size()
             # set the datetime of last download to last modified date
             # of zip file
             timestamp = os.path.getmtime(self.zip_path)
@@ -140,16 +230,23 @@ class Command(CalAccessCommand):
             )
 
         self.download()
-        self.unzip()
 
-        if not options['keep_files']:
-            os.remove(self.zip_path)
+        if options['skip_unzip']:
+            # The archive stays put, since it is the only copy of the data
+            self.unzip(extract=False)
+        else:
+            self.unzip()
 
-        self.prep()
+            if not options['keep_files']:
+                os.remove(self.zip_path)
 
-        if not options['keep_files']:
-            shutil.rmtree(os.path.join(self.data_dir, 'CalAccess'))
+            self.prep()
 
+        self.record_metrics(
+            self.log_record,
+            bytes_in=self.current_release_size,
+            bytes_out=self.unzipped_size,
+        )
         self.log_record.finish_datetime = datetime.now()
         self.log_record.save()
 
@@ -175,6 +272,18 @@ class Command(CalAccessCommand):
                         result = True
         return result
 
+    def get_local_file_size(self):
+        """
+        Returns the number of bytes of the ZIP file already downloaded.
+
+        A segmented download preallocates the whole file, so its progress
+        is read from the segments file rather than the size of the ZIP.
+        """
+        segments = self.load_segments()
+        if segments:
+            return sum(s['downloaded'] for s in segments)
+        return os.path.getsize(self.zip_path)
+
     def download(self):
         """
         Download the ZIP file in pieces.
@@ -185,78 +294,278 @@ class Command(CalAccessCommand):
             else:
                 self.header("Downloading ZIP file")
 
+        # A partial segmented download can only be picked up in segments
+        if self.resume_download and self.load_segments():
+            self.download_segments()
+            return
+
+        if os.path.exists(self.zip_path) and not self.resume_download:
+            os.remove(self.zip_path)
+        if os.path.exists(self.segments_path):
+            os.remove(self.segments_path)
+
+        if self.connections > 1 and self.accept_ranges:
+            self.download_segments()
+        else:
+            self.download_stream()
+
+    def download_stream(self):
+        """
+        Download the ZIP file over a single connection.
+        """
         expected_size = self.current_release_size
 
         # Prep
         headers = dict()
-        if os.path.exists(self.zip_path):
-            if self.resume_download:
-
-                headers['Range'] = 'bytes=%d-' % self.local_file_size
-                expected_size = expected_size - self.local_file_size
-            else:
-                os.remove(self.zip_path)
+        if self.resume_download and os.path.exists(self.zip_path):
+            headers['Range'] = 'bytes=%d-' % self.local_file_size
+            expected_size = expected_size - self.local_file_size
 
         # Stream the download
-        chunk_size = 1024
         req = requests.get(self.url, stream=True, headers=headers)
-        n_iters = float(expected_size) / chunk_size + 1
+        n_iters = float(expected_size) / self.chunk_size + 1
         with open(self.zip_path, 'ab') as fp:
-            for chunk in progress.bar(req.iter_content(chunk_size=chunk_size),
+            for chunk in progress.bar(req.iter_content(chunk_size=self.chunk_size),
                                       expected_size=n_iters):
                 fp.write(chunk)
-                fp.flush()
 
-    def unzip(self):
+    def download_segments(self):
         """
-        Unzip the snapshot file.
+        Download the ZIP file as byte ranges fetched over concurrent connections.
+
+        Each segment writes into its own slice of a preallocated file and
+        periodically saves how far it has gotten, so an interrupted download
+        can pick up every segment where it left off.
+        """
+        segments = self.load_segments()
+        if not segments:
+            segments = self.get_segments()
+            # Preallocate the file so each segment can seek to its offset
+            with open(self.zip_path, 'wb') as fp:
+                fp.truncate(self.current_release_size)
+            self.save_segments(segments)
+
+        self.segments = segments
+        self.segments_lock = threading.Lock()
+        self.progress_bar = progress.Bar(
+            expected_size=self.current_release_size,
+            hide=None if self.verbosity else True,
+        )
+        self.progress_bytes = sum(s['downloaded'] for s in segments)
+        self.progress_bar.show(self.progress_bytes)
+
+        pool = ThreadPool(processes=min(self.connections, len(segments)))
+        try:
+            pool.map(self.download_segment, segments)
+        finally:
+            pool.close()
+            pool.join()
+            self.progress_bar.done()
+
+        # All the pieces are in place, so the progress file is no longer needed
+        os.remove(self.segments_path)
+
+    def get_segments(self):
+        """
+        Returns a list splitting the expected size of the ZIP file into
+        one byte range per connection.
+        """
+        segments = []
+        segment_size = -(-self.current_release_size // self.connections)
+        for start in range(0, self.current_release_size, segment_size):
+            end = min(start + segment_size, self.current_release_size) - 1
+            segments.append(dict(start=start, end=end, downloaded=0))
+        return segments
+
+    def load_segments(self):
+        """
+        Returns the list of segments saved by a previous segmented download,
+        or None if there isn't one.
+        """
+        if not os.path.exists(self.segments_path):
+            return None
+        with open(self.segments_path, 'r') as fp:
+            return json.load(fp)
+
+    def save_segments(self, segments):
+        """
+        Writes the progress of each segment to disk.
+        """
+        tmp_path = self.segments_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(segments, fp)
+        os.rename(tmp_path, self.segments_path)
+
+    def download_segment(self, segment):
+        """
+        Download the remaining bytes of a single segment into the ZIP file.
+        """
+        offset = segment['start'] + segment['downloaded']
+        if offset > segment['end']:
+            return
+
+        headers = {'Range': 'bytes=%d-%d' % (offset, segment['end'])}
+        req = requests.get(self.url, stream=True, headers=headers)
+        req.raise_for_status()
+        if req.status_code != 206:
+            raise CommandError("Server did not honor range request %s" % headers['Range'])
+
+        unsaved = 0
+        with open(self.zip_path, 'r+b') as fp:
+            fp.seek(offset)
+            for chunk in req.iter_content(chunk_size=self.chunk_size):
+                fp.write(chunk)
+                unsaved += len(chunk)
+                with self.segments_lock:
+                    self.progress_bytes += len(chunk)
+                    self.progress_bar.show(self.progress_bytes)
+                if unsaved >= self.checkpoint_size:
+                    # Only count bytes as downloaded once they are on disk
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                    with self.segments_lock:
+                        segment['downloaded'] += unsaved
+                        self.save_segments(self.segments)
+                    unsaved = 0
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        with self.segments_lock:
+            segment['downloaded'] += unsaved
+            self.save_segments(self.segments)
+
+        expected = segment['end'] - segment['start'] + 1
+        if segment['downloaded'] != expected:
+            raise CommandError(
+                "Segment %(start)s-%(end)s downloaded %(downloaded)s bytes" % segment
+            )
+
+    def unzip(self, extract=True):
+        """
+        Unzip the snapshot's data files into the tsv directory.
+
+        Along the way, each TSV's CRC-32 and size are recorded from the
+        ZIP's central directory. In incremental mode, files that match the
+        previously loaded version are left in the archive, as are the files
+        of any tables that weren't picked. If extract is False, only the
+        records are made.
         """
         if self.verbosity:
-            self.log(" Unzipping archive")
+            self.log(" Unzipping archive" if extract else " Reading archive")
+
+        self.unchanged_files = []
 
+        # Clear out target if it exists
+        if extract:
+            if os.path.exists(self.tsv_dir):
+                shutil.rmtree(self.tsv_dir)
+            os.makedirs(self.tsv_dir)
+
+        jobs = []
         with zipfile.ZipFile(self.zip_path) as zf:
             for member in zf.infolist():
-                words = member.filename.split('/')
-                path = self.data_dir
-                for word in words[:-1]:
-                    drive, word = os.path.splitdrive(word)
-                    head, word = os.path.split(word)
-                    if word in (os.curdir, os.pardir, ''):
+                # Files of tables that weren't picked are left in the archive
+                if self.tsv_names is not None:
+                    if os.path.basename(member.filename).upper() not in self.tsv_names:
+                        continue
+                if member.filename.upper().endswith('.TSV'):
+                    raw_file = self.record_fingerprint(member)
+                    if self.incremental and raw_file.is_unchanged():
+                        self.unchanged_files.append(raw_file.file_name)
                         continue
-                    path = os.path.join(path, word)
-                zf.extract(member, path)
+                # Only the data files are kept, and they all go in one folder
+                if not extract or not member.filename.startswith(self.zip_data_dir):
+                    continue
+                file_name = os.path.basename(member.filename)
+                if not file_name:
+                    continue
+                jobs.append((member.file_size, member.filename, file_name))
+
+        if self.verbosity > 1 and self.unchanged_files:
+            self.log("  {} files unchanged since last load".format(
+                len(self.unchanged_files)
+            ))
+
+        self.unzipped_size = sum(file_size for file_size, member_name, file_name in jobs)
+        if not jobs:
+            return
+
+        # Start with the biggest files so they don't hold up the end
+        jobs.sort(reverse=True)
+        args = [
+            (self.zip_path, member_name, os.path.join(self.tsv_dir, file_name))
+            for file_size, member_name, file_name in jobs
+        ]
+
+        start = datetime.now()
+        if self.unzip_workers > 1:
+            pool = multiprocessing.Pool(processes=min(self.unzip_workers, len(args)))
+            try:
+                for result in pool.imap_unordered(extract_member, args):
+                    self.log_extract(*result)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for arg in args:
+                self.log_extract(*extract_member(arg))
+
+        if self.verbosity > 1:
+            elapsed = datetime.now() - start
+            self.log("  {} files, {} in {} ({}/s)".format(
+                len(jobs),
+                size(self.unzipped_size),
+                elapsed,
+                size(self.get_throughput(self.unzipped_size, elapsed)),
+            ))
+
+    def log_extract(self, member_name, file_size, elapsed):
+        """
+        Reports how long it took to unzip a member of the archive.
+        """
+        if self.verbosity > 2:
+            self.log("  {}: {} in {} ({}/s)".format(
+                os.path.basename(member_name),
+                size(file_size),
+                elapsed,
+                size(self.get_throughput(file_size, elapsed)),
+            ))
+
+    def get_throughput(self, file_size, elapsed):
+        """
+        Returns the number of bytes handled per second.
+        """
+        seconds = elapsed.total_seconds()
+        if not seconds:
+            return file_size
+        return int(file_size / seconds)
+
+    def record_fingerprint(self, member):
+        """
+        Saves the CRC-32 and size of a ZIP member on its RawDataFile record.
+
+        Returns the record.
+        """
+        file_name = os.path.basename(member.filename).upper().replace('.TSV', '')
+        raw_file = self.raw_data_files.get_or_create(
+            version=self.log_record.version,
+            file_name=file_name,
+        )[0]
+        raw_file.download_crc32 = member.CRC
+        raw_file.download_file_size = member.file_size
+        raw_file.save()
+        return raw_file
 
     def prep(self):
         """
-        Rearrange the unzipped files and get rid of the stuff we don't want.
+        Make a record for each of the unzipped files.
         """
         if self.verbosity:
             self.log(" Prepping unzipped data")
 
-        # Move the deep down directory we want out
-        shutil.move(
-            os.path.join(
-                self.data_dir,
-                'CalAccess/DATA/CalAccess/DATA/'
-            ),
-            self.data_dir
-        )
-        # Clear out target if it exists
-        if os.path.exists(self.tsv_dir):
-            shutil.rmtree(self.tsv_dir)
-
-        # Rename it to the target
-        shutil.move(
-            os.path.join(self.data_dir, "DATA/"),
-            self.tsv_dir,
-        )
-
         # make the RawDataFile records
         for f in os.listdir(self.tsv_dir):
-            try:
-                self.raw_data_files.create(
-                    version=self.log_record.version,
-                    file_name=f.upper().replace('.TSV', ''),
-                )
-            except IntegrityError:
-                pass
+            self.raw_data_files.get_or_create(
+                version=self.log_record.version,
+                file_name=f.upper().replace('.TSV', ''),
+            )
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import csv
+from django.apps import apps
+from csvkit import CSVKitReader
+from hurry.filesize import size
+from django.core.management.base import CommandError
+from calaccess_raw import get_download_directory, open_csv
+from calaccess_raw.management.commands import CalAccessCommand
+
+
+def get_arrow_type(field):
+    """
+    Returns the Apache Arrow type that holds the values of a model field.
+    """
+    import pyarrow
+    internal_type = field.get_internal_type()
+    if internal_type == 'DateField':
+        return pyarrow.date32()
+    elif internal_type == 'DateTimeField':
+        # COPY reads the source's timestamps as UTC, so do the same
+        return pyarrow.timestamp('us', tz='UTC')
+    elif internal_type == 'DecimalField':
+        return pyarrow.decimal128(field.max_digits, field.decimal_places)
+    elif internal_type == 'FloatField':
+        return pyarrow.float64()
+    elif internal_type == 'IntegerField':
+        return pyarrow.int32()
+    return pyarrow.string()
+
+
+class Command(CalAccessCommand):
+    help = 'Export a clean CAL-ACCESS CSV file to a compressed Parquet file'
+
+    def add_arguments(self, parser):
+        """
+        Adds custom arguments specific to this command.
+        """
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            'model_name',
+            help="Name of the model whose CSV file will be exported"
+        )
+        parser.add_argument(
+            "--compression",
+            action="store",
+            dest="compression",
+            default="zstd",
+            help="Compression codec for the Parquet file, like zstd, snappy or gzip"
+        )
+        parser.add_argument(
+            "--row-group-size",
+            action="store",
+            type=int,
+            dest="row_group_size",
+            default=250000,
+            help="Number of rows in each of the Parquet file's row groups"
+        )
+        parser.add_argument(
+            "-a",
+            "--app-name",
+            dest="app_name",
+            default="calaccess_raw",
+            help="Name of Django app with models into which data will "
+                 "be imported (if other not calaccess_raw)"
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise CommandError("Exporting to Parquet requires the pyarrow library.")
+
+        self.model = apps.get_model(options["app_name"], options['model_name'])
+        self.csv = self.model.objects.get_csv_path()
+        manifest = self.model.objects.get_manifest()
+        self.normalized = bool(manifest and manifest.get('normalized'))
+        self.parquet_dir = os.path.join(get_download_directory(), "parquet")
+        os.path.exists(self.parquet_dir) or os.makedirs(self.parquet_dir)
+        self.parquet_path = os.path.join(
+            self.parquet_dir,
+            "%s.parquet" % self.model._meta.db_table.lower()
+        )
+
+        if self.verbosity > 2:
+            self.log(" Exporting %s" % options['model_name'])
+
+        csv.field_size_limit(1000000000)
+        fields = dict((f.db_column, f) for f in self.model._meta.fields)
+
+        with open_csv(self.csv) as infile:
+            csv_reader = CSVKitReader(infile)
+            try:
+                headers = next(csv_reader)
+            except StopIteration:
+                if self.verbosity > 2:
+                    self.failure("File is empty.")
+                return
+
+            columns = [fields[h] for h in headers]
+            # Fields that can't be null in the database still get empty values
+            # in the source, which are read as nulls for every type but text
+            schema = pyarrow.schema([
+                pyarrow.field(f.column, get_arrow_type(f), nullable=True)
+                for f in columns
+            ])
+            writer = pyarrow.parquet.ParquetWriter(
+                self.parquet_path,
+                schema,
+                compression=options['compression'],
+            )
+            try:
+                # Each batch of rows becomes one row group in the file
+                rows_count = 0
+                batch = []
+                for row in csv_reader:
+                    batch.append(row)
+                    if len(batch) == options['row_group_size']:
+                        writer.write_table(self.get_table(batch, columns, schema))
+                        rows_count += len(batch)
+                        batch = []
+                if batch:
+                    writer.write_table(self.get_table(batch, columns, schema))
+                    rows_count += len(batch)
+            finally:
+                writer.close()
+
+        if self.verbosity > 2:
+            self.log("  %s rows written to %s (%s)" % (
+                rows_count,
+                self.parquet_path,
+                size(os.path.getsize(self.parquet_path)),
+            ))
+
+    def get_table(self, rows, columns, schema):
+        """
+        Returns an Arrow table of CSV rows, converted by each field's from_csv,
+        or its from_normalized_csv if the file was normalized.
+        """
+        import pyarrow
+        arrays = []
+        for i, field in enumerate(columns):
+            convert = field.from_normalized_csv if self.normalized else field.from_csv
+            arrays.append(pyarrow.array(
+                [convert(row[i]) for row in rows],
+                type=schema.field(i).type,
+            ))
+        return pyarrow.Table.from_arrays(arrays, schema=schema)
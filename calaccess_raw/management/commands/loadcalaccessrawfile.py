@@ -2,18 +2,209 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import os
+import re
+import csv
 import six
+import shutil
+import tempfile
+import threading
 from datetime import datetime
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 from django.apps import apps
 from csvkit import CSVKitReader
 from django.conf import settings
 from postgres_copy import CopyMapping
-from django.db import connections, router
+from django.db import connections, router, transaction
+from django.db.backends.utils import truncate_name
 from django.core.management.base import CommandError
+from calaccess_raw import (
+    CSV_COMPRESSION_EXTENSIONS,
+    get_download_directory,
+    get_duckdb_connection,
+    get_manifest_path,
+    install_copy_functions,
+    open_csv,
+    read_manifest
+)
 from calaccess_raw.management.commands import CalAccessCommand
+from calaccess_raw.management.commands.cleancalaccessrawfile import (
+    REPAIR_WINDOW,
+    CleanedStream,
+    get_zip_members,
+    open_zip_member,
+    read_headers,
+    write_error_log,
+)
 from calaccess_raw.models.tracking import RawDataVersion
 
 
+def build_index(args):
+    """
+    Runs a CREATE INDEX statement on its own connection from within a worker thread.
+    """
+    database, sql = args
+    connection = connections[database]
+    try:
+        connection.cursor().execute(sql)
+    finally:
+        # Django opens a connection for each thread, so close this one's
+        connection.close()
+
+
+def feed_pipe(csv_path, pipe_path):
+    """
+    Writes the decompressed contents of a CSV file into a named pipe.
+    """
+    try:
+        with open_csv(csv_path, 'rb') as csv_file:
+            with open(pipe_path, 'wb') as pipe:
+                shutil.copyfileobj(csv_file, pipe)
+    except IOError:
+        # The reader went away, which the load will report on its own
+        pass
+
+
+class TableCopyMapping(CopyMapping):
+    """
+    A CopyMapping that can insert into a table other than the model's own,
+    like a staging table with the same columns, and that can read
+    compressed CSV files.
+    """
+    # How much of the file psycopg2 asks for at a time
+    copy_size = 1024 * 1024
+
+    def __init__(self, model, csv_path, mapping, db_table=None, **kwargs):
+        self.db_table = db_table or model._meta.db_table
+        super(TableCopyMapping, self).__init__(model, csv_path, mapping, **kwargs)
+
+    def get_headers(self):
+        """
+        Returns the column headers from the csv as a list.
+        """
+        with open_csv(self.csv_path) as infile:
+            csv_reader = CSVKitReader(infile, delimiter=self.delimiter)
+            headers = next(csv_reader)
+        return headers
+
+    def prep_drop(self):
+        """
+        Creates the DROP statement that gets rid of the temporary table.
+
+        CopyMapping leaves its name unquoted, which misses the table created
+        under its quoted, upper case name, so a second load of the same model
+        on one connection would find it still there.
+        """
+        return 'DROP TABLE IF EXISTS "%s";' % self.temp_table_name
+
+    def prep_insert(self):
+        """
+        Creates the INSERT statement that moves rows from the temporary table
+        into the target table.
+        """
+        sql = super(TableCopyMapping, self).prep_insert()
+        return sql.replace(
+            'INSERT INTO "%s"' % self.model._meta.db_table,
+            'INSERT INTO "%s"' % self.db_table,
+            1
+        )
+
+    def save(self, silent=False, stream=None):
+        """
+        Copies the contents of the CSV file into the target table.
+        """
+        with open_csv(self.csv_path) as csv_file:
+            self.copy(csv_file)
+
+    def copy(self, csv_file):
+        """
+        Copies the contents of an open CSV file into the target table by way
+        of a temporary table.
+        """
+        cursor = self.conn.cursor()
+        drop_sql = self.prep_drop()
+        cursor.execute(drop_sql)
+        cursor.execute(self.prep_create())
+        cursor.copy_expert(self.prep_copy(), csv_file, size=self.copy_size)
+        cursor.execute(self.prep_insert())
+        cursor.execute(drop_sql)
+
+
+class StreamCopyMapping(TableCopyMapping):
+    """
+    A CopyMapping that reads its CSV from a file-like object rather than
+    a path on disk.
+    """
+    def __init__(self, model, stream, headers, mapping, **kwargs):
+        self.stream = stream
+        self.headers = headers
+        # CopyMapping insists on a path that exists, so hand it the source TSV
+        super(StreamCopyMapping, self).__init__(
+            model,
+            model.objects.get_tsv_path(),
+            mapping,
+            **kwargs
+        )
+
+    def get_headers(self):
+        """
+        Returns the column headers provided with the stream.
+        """
+        return self.headers
+
+    def save(self, silent=False, stream=None):
+        """
+        Copies the contents of the stream into the target table.
+        """
+        self.copy(self.stream)
+
+
+class NormalizedCopy(object):
+    """
+    Copies a CSV file whose values were normalized by cleancalaccessrawfile
+    straight into a table's typed columns, without the temporary table and
+    SQL transformations CopyMapping needs.
+
+    It can be handed to copy_postgresql in place of a TableCopyMapping.
+    """
+    # How much of the file psycopg2 asks for at a time
+    copy_size = 1024 * 1024
+
+    def __init__(self, model, csv_path, headers, using=None, db_table=None):
+        self.model = model
+        self.csv_path = csv_path
+        self.headers = headers
+        self.conn = connections[using or router.db_for_write(model)]
+        self.db_table = db_table or model._meta.db_table
+
+    def prep_copy(self):
+        """
+        Creates the COPY statement that reads the file into the table.
+        """
+        fields = dict((f.db_column, f) for f in self.model._meta.fields)
+        # An empty value is a null everywhere except in a text column
+        nulls = [
+            h for h in self.headers
+            if fields[h].get_internal_type() != 'CharField'
+        ]
+        options = ['FORMAT csv', 'HEADER true']
+        if nulls:
+            options.append('FORCE_NULL (%s)' % ', '.join('"%s"' % h for h in nulls))
+        return 'COPY "%s" (%s) FROM STDIN WITH (%s)' % (
+            self.db_table,
+            ', '.join('"%s"' % fields[h].column for h in self.headers),
+            ', '.join(options),
+        )
+
+    def save(self, silent=False, stream=None):
+        """
+        Copies the contents of the CSV file into the target table.
+        """
+        cursor = self.conn.cursor()
+        with open_csv(self.csv_path) as csv_file:
+            cursor.copy_expert(self.prep_copy(), csv_file, size=self.copy_size)
+
+
 class Command(CalAccessCommand):
     help = 'Load clean CAL-ACCESS CSV file into a database model'
     # Trick for reformating date strings in source data so that they can
@@ -21,6 +212,15 @@ class Command(CalAccessCommand):
     date_sql = "DATE_FORMAT(str_to_date(@`%s`, '%%c/%%e/%%Y'), '%%Y-%%m-%%d')"
     datetime_sql = "DATE_FORMAT(str_to_date(@`%s`, '%%c/%%e/%%Y \
 %%h:%%i:%%s %%p'), '%%Y-%%m-%%d  %%H:%%i:%%s')"
+    # Number of rows in each INSERT sent to SQLite
+    sqlite_batch_size = 10000
+    # Values that stand in for null in a nullable UNIQUE_KEY column during a
+    # delta load, by field type. Zero stands in for any other type.
+    null_key_values = dict(
+        CharField="''",
+        DateField="'-infinity'::date",
+        DateTimeField="'-infinity'::timestamptz",
+    )
 
     def add_arguments(self, parser):
         """
@@ -47,6 +247,65 @@ class Command(CalAccessCommand):
             default=False,
             help="Keep CSV file after loading"
         )
+        parser.add_argument(
+            "--from-tsv",
+            action="store_true",
+            dest="from_tsv",
+            default=False,
+            help="Clean the source TSV file as it is loaded, without writing "
+                 "a CSV file (PostgreSQL only)"
+        )
+        parser.add_argument(
+            "--from-zip",
+            action="store_true",
+            dest="from_zip",
+            default=False,
+            help="Like --from-tsv, but read the TSV file straight out of the "
+                 "downloaded ZIP archive (PostgreSQL only)"
+        )
+        parser.add_argument(
+            "--repair-window",
+            action="store",
+            type=int,
+            dest="repair_window",
+            default=REPAIR_WINDOW,
+            help="Most lines to join back into a record broken up by line "
+                 "breaks in its values, when cleaning with --from-tsv or --from-zip"
+        )
+        parser.add_argument(
+            "--staging",
+            action="store_true",
+            dest="staging",
+            default=False,
+            help="Load into a staging table and swap it in when complete, "
+                 "so the model's table is never empty"
+        )
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            dest="delta",
+            default=False,
+            help="Apply only the inserts, updates and deletes that differ from "
+                 "the loaded table, matched on the model's UNIQUE_KEY. Models without "
+                 "a usable UNIQUE_KEY are reloaded in full (PostgreSQL only)"
+        )
+        parser.add_argument(
+            "--defer-indexes",
+            action="store_true",
+            dest="defer_indexes",
+            default=False,
+            help="Drop the table's secondary indexes before loading and "
+                 "rebuild them afterwards (PostgreSQL only)"
+        )
+        parser.add_argument(
+            "--index-workers",
+            action="store",
+            type=int,
+            dest="index_workers",
+            default=1,
+            help="Number of the staging table's indexes to build at the same "
+                 "time, each on its own database connection (PostgreSQL only)"
+        )
         parser.add_argument(
             "-a",
             "--app-name",
@@ -63,15 +322,37 @@ class Command(CalAccessCommand):
 
         # set / compute any attributes that multiple class methods need
         self.keep_files = options["keep_files"]
+        self.staging = options["staging"]
+        self.defer_indexes = options["defer_indexes"]
+        self.index_workers = max(options["index_workers"], 1)
+        self.copy_duration = None
+        self.index_duration = None
         # get model based on strings of app_name and model_name
         self.model = apps.get_model(options["app_name"], options['model_name'])
 
         # load from provided csv or csv mapped to model
         self.csv = options["csv"] or self.model.objects.get_csv_path()
+        # the file's manifest, if cleancalaccessrawfile wrote one, saves scanning it
+        self.manifest = None
+        self.normalized = False
 
         # load into database suggested for model by router
         self.database = router.db_for_write(model=self.model)
 
+        # only PostgreSQL can merge the changed rows into the loaded table
+        if options["delta"] and connections[self.database].vendor != 'postgresql':
+            raise CommandError("--delta is only supported on PostgreSQL.")
+
+        # models without a unique key of real columns can only be reloaded in full
+        key_columns = set(self.model().get_unique_key_list())
+        self.delta = options["delta"] and bool(key_columns) and key_columns.issubset(
+            f.column for f in self.model._meta.fields
+        )
+        if options["delta"] and not self.delta and self.verbosity:
+            self.log(" No usable UNIQUE_KEY on %s. Reloading the whole table." % (
+                options['model_name']
+            ))
+
         if self.verbosity > 2:
             self.log(" Loading %s" % options['model_name'])
 
@@ -103,6 +384,16 @@ class Command(CalAccessCommand):
                     file_name=self.model._meta.db_table
                 )
 
+        self.from_zip = options['from_zip']
+        self.repair_window = options['repair_window']
+        if options['from_tsv'] or self.from_zip:
+            self.tsv = self.model.objects.get_tsv_path()
+            self.clean_and_load()
+            return
+
+        self.manifest = read_manifest(self.csv)
+        # whether cleancalaccessrawfile already normalized the file's values
+        self.normalized = bool(self.manifest and self.manifest.get('normalized'))
         row_count = self.get_row_count()
 
         if row_count > 0:
@@ -121,15 +412,24 @@ class Command(CalAccessCommand):
             # add clean counts to raw_file_record
             raw_file.clean_columns_count = len(self.get_headers())
             raw_file.clean_records_count = self.get_row_count()
+            raw_file.load_copy_duration = self.copy_duration
+            raw_file.load_index_duration = self.index_duration
             raw_file.save()
 
             # save the log record
+            self.record_metrics(
+                self.log_record,
+                bytes_in=os.path.getsize(self.csv),
+                records_count=self.get_row_count(),
+            )
             self.log_record.finish_datetime = datetime.now()
             self.log_record.save()
 
         # if not keeping files, remove the csv file
         if not self.keep_files:
             os.remove(self.csv)
+            if self.manifest:
+                os.remove(get_manifest_path(self.csv))
 
     def load(self):
         """
@@ -139,6 +439,10 @@ class Command(CalAccessCommand):
         if getattr(settings, 'CALACCESS_DAT_SOURCE', None) and six.PY2:
             self.load_dat()
 
+        # check if can load into duckdb
+        if getattr(settings, 'CALACCESS_DUCKDB_PATH', None):
+            self.load_duckdb()
+
         # if not using default db, make sure the database is set up in django's settings
         if self.database:
             try:
@@ -160,11 +464,109 @@ class Command(CalAccessCommand):
             'django.contrib.gis.db.backends.postgis'
         ):
             self.load_postgresql()
+        elif engine == 'django.db.backends.sqlite3':
+            self.load_sqlite()
         else:
             self.failure("Sorry your database engine is unsupported")
             raise CommandError(
-                "Only MySQL and PostgresSQL backends supported."
+                "Only MySQL, PostgresSQL and SQLite backends supported."
+            )
+
+    def clean_and_load(self):
+        """
+        Cleans the source TSV file and streams it into the model's table with
+        PostgreSQL's COPY, skipping the intermediate CSV file.
+        """
+        csv.field_size_limit(1000000000)
+        self.connection = connections[self.database]
+        if self.connection.vendor != 'postgresql':
+            raise CommandError(
+                "Loading straight from TSV is only supported for PostgreSQL."
+            )
+        self.cursor = self.connection.cursor()
+
+        if self.from_zip:
+            tsv_file = open_zip_member(
+                os.path.join(get_download_directory(), 'calaccess.zip'),
+                os.path.basename(self.tsv)
+            )
+        else:
+            tsv_file = open(self.tsv, 'rb')
+
+        with tsv_file:
+            headers = read_headers(tsv_file) or []
+            stream = CleanedStream(tsv_file, headers, max(self.repair_window, 1))
+
+            if headers:
+                with self.postgresql_transaction():
+                    db_table = self.start_postgresql()
+                    c = StreamCopyMapping(
+                        self.model,
+                        stream,
+                        headers,
+                        dict((f.name, f.db_column) for f in self.model._meta.fields),
+                        using=self.database,
+                        db_table=db_table,
+                    )
+                    self.copy_postgresql(c)
+
+        if self.verbosity > 2:
+            msg = '  Bad parse of line %s (%s headers, %s values)'
+            for row in stream.log_rows:
+                self.failure(msg % tuple(row[:3]))
+
+        # Log errors if there are any
+        if stream.log_rows:
+            if self.verbosity > 1:
+                msg = '  %s errors'
+                self.failure(msg % (len(stream.log_rows) - 1))
+            write_error_log(
+                os.path.join(
+                    get_download_directory(),
+                    "log",
+                    os.path.basename(self.tsv).lower().replace("tsv", "errors.csv")
+                ),
+                stream.log_rows
+            )
+
+        # Print out the results
+        if self.verbosity > 2:
+            self.finish_load_message(self.model.objects.count(), stream.rows_count)
+
+        # handle tracking data
+        if self.version:
+            raw_file = self.raw_data_files.get_or_create(
+                version=self.version,
+                file_name=self.log_record.file_name
+            )[0]
+
+            # add download and clean counts to raw_file_record
+            raw_file.download_columns_count = len(headers)
+            raw_file.download_records_count = stream.lines_count
+            raw_file.clean_columns_count = len(headers)
+            raw_file.clean_records_count = stream.rows_count
+            raw_file.clean_errors_count = len(stream.log_rows)
+            raw_file.load_copy_duration = self.copy_duration
+            raw_file.load_index_duration = self.index_duration
+            raw_file.save()
+
+            # save the log record
+            if self.from_zip:
+                zip_path = os.path.join(get_download_directory(), 'calaccess.zip')
+                bytes_in = get_zip_members(zip_path)[os.path.basename(self.tsv)].file_size
+            else:
+                bytes_in = os.path.getsize(self.tsv)
+            self.record_metrics(
+                self.log_record,
+                bytes_in=bytes_in,
+                records_count=stream.rows_count,
             )
+            self.log_record.finish_datetime = datetime.now()
+            self.log_record.save()
+
+        # if not keeping files, remove the tsv file
+        if not self.keep_files and not self.from_zip:
+            os.remove(self.tsv)
 
     def load_dat(self):
         """
@@ -179,7 +581,7 @@ class Command(CalAccessCommand):
             if self.verbosity > 2:
                 dat_status = self.dat.status()
                 model_count = dat_status['rows']
-                csv_count = self.get_row_count(self.csv)
+                csv_count = self.get_row_count()
                 self.finish_load_message(model_count, csv_count)
         except datpy.DatException:
             raise CommandError(
@@ -189,6 +591,57 @@ class Command(CalAccessCommand):
                 )
             )
 
+    def load_duckdb(self):
+        """
+        Loads the csv file into a table in the DuckDB database file
+        """
+        db_table = self.model._meta.db_table
+        fields = dict((f.db_column, f) for f in self.model._meta.fields)
+        headers = self.get_headers()
+        if self.normalized:
+            # Normalized values only need empty strings turned into nulls,
+            # which read_csv does to every column, so put back the text ones
+            columns = [
+                """COALESCE("%s", '')""" % h if fields[h].get_internal_type() == 'CharField'
+                else """CAST(NULLIF("%s", '') AS %s)""" % (h, fields[h].get_duckdb_type())
+                for h in headers
+            ]
+        else:
+            columns = [
+                fields[h].duckdb_template % dict(fields[h].__dict__, name=h)
+                for h in headers
+            ]
+
+        connection = get_duckdb_connection(read_only=False)
+        try:
+            connection.execute("BEGIN TRANSACTION")
+            connection.execute('CREATE OR REPLACE TABLE "%s" (%s)' % (
+                db_table,
+                ", ".join(
+                    '"%s" %s' % (h, fields[h].get_duckdb_type()) for h in headers
+                ),
+            ))
+            connection.execute(
+                """
+                INSERT INTO "%s"
+                SELECT %s
+                FROM read_csv('%s', header=true, all_varchar=true, quote='"', escape='"')
+                """ % (
+                    db_table,
+                    ", ".join(columns),
+                    self.csv.replace("'", "''"),
+                )
+            )
+            connection.execute("COMMIT")
+
+            if self.verbosity > 2:
+                model_count = connection.execute(
+                    'SELECT COUNT(*) FROM "%s"' % db_table
+                ).fetchone()[0]
+                self.finish_load_message(model_count, self.get_row_count())
+        finally:
+            connection.close()
+
     def load_mysql(self):
         """
         Load the file into a MySQL database using LOAD DATA INFILE
@@ -197,8 +650,19 @@ class Command(CalAccessCommand):
         import MySQLdb
         warnings.filterwarnings("ignore", category=MySQLdb.Warning)
 
-        # Flush the target model
-        self.cursor.execute('TRUNCATE TABLE %s' % self.model._meta.db_table)
+        db_table = self.start_mysql()
+
+        # MySQL can only read a plain file, so decompress into a pipe it reads from
+        csv_root, csv_extension = os.path.splitext(self.csv)
+        if csv_extension not in CSV_COMPRESSION_EXTENSIONS.values():
+            infile = self.csv
+            feeder = None
+        else:
+            pipe_dir = tempfile.mkdtemp()
+            infile = os.path.join(pipe_dir, os.path.basename(csv_root))
+            os.mkfifo(infile)
+            feeder = threading.Thread(target=feed_pipe, args=(self.csv, infile))
+            feeder.start()
 
         # Build the MySQL LOAD DATA INFILE command
         bulk_sql_load_part_1 = """
@@ -210,8 +674,8 @@ class Command(CalAccessCommand):
             IGNORE 1 LINES
             (
         """ % (
-            self.csv,
-            self.model._meta.db_table
+            infile,
+            db_table
         )
 
         # Get the headers and the row count from the source CSV
@@ -228,6 +692,14 @@ class Command(CalAccessCommand):
         for h in csv_headers:
             # Pull the data type of the field
             data_type = field_types[h]
+            # Normalized values only need empty strings turned into nulls
+            if self.normalized:
+                if data_type.startswith('varchar'):
+                    header_sql_list.append('`%s`' % h)
+                else:
+                    header_sql_list.append('@`%s`' % h)
+                    date_set_list.append("`%s` = NULLIF(@`%s`, '')" % (h, h))
+                continue
             # If it is a date field, we need to reformat the data
             # so that MySQL will properly parse it on the way in.
             if data_type == 'date':
@@ -248,7 +720,17 @@ class Command(CalAccessCommand):
             bulk_sql_load += " set %s" % ",".join(date_set_list)
 
         # Run the query
-        cnt = self.cursor.execute(bulk_sql_load)
+        start = datetime.now()
+        try:
+            cnt = self.cursor.execute(bulk_sql_load)
+        finally:
+            if feeder:
+                # Unblock the feeder if MySQL never opened the pipe
+                os.close(os.open(infile, os.O_RDONLY | os.O_NONBLOCK))
+                feeder.join()
+                shutil.rmtree(pipe_dir)
+        self.copy_duration = datetime.now() - start
+        self.finish_mysql(db_table)
 
         # Report back on how we did
         if self.verbosity > 2:
@@ -258,18 +740,96 @@ class Command(CalAccessCommand):
         """
         Load the file into a PostgreSQL database using COPY
         """
-        # Drop all the records from the target model's real table
-        self.cursor.execute('TRUNCATE TABLE "%s" CASCADE' % (
-            self.model._meta.db_table
-        ))
+        with self.postgresql_transaction():
+            db_table = self.start_postgresql()
+            if self.normalized:
+                c = NormalizedCopy(
+                    self.model,
+                    self.csv,
+                    self.get_headers(),
+                    using=self.database,
+                    db_table=db_table,
+                )
+            else:
+                c = TableCopyMapping(
+                    self.model,
+                    self.csv,
+                    dict((f.name, f.db_column) for f in self.model._meta.fields),
+                    using=self.database,
+                    db_table=db_table,
+                )
+            self.copy_postgresql(c)
 
-        c = CopyMapping(
-            self.model,
-            self.csv,
-            dict((f.name, f.db_column) for f in self.model._meta.fields),
-            using=self.database,
-        )
-        c.save(silent=True)
+        # Print out the results
+        if self.verbosity > 2:
+            csv_count = self.get_row_count()
+            model_count = self.model.objects.count()
+            self.finish_load_message(model_count, csv_count)
+
+    def get_staging_name(self, name):
+        """
+        Returns the name of the staging copy of a table or index, kept within
+        the 63 characters PostgreSQL allows.
+
+        A name too long to fit is cut short and ends in a hash of the whole
+        name, like Django's own, so two long names never share a copy.
+        """
+        return "%s_staging" % truncate_name(name, 63 - len("_staging"))
+
+    def load_sqlite(self):
+        """
+        Load the file into a SQLite database with batches of INSERT statements
+        """
+        fields = dict((f.db_column, f) for f in self.model._meta.fields)
+
+        # Trade crash safety for speed. A failed load is simply run again.
+        pragmas = dict(cache_size=-256000)
+        if not self.connection.in_atomic_block:
+            # These can't be changed inside a transaction
+            pragmas.update(synchronous='OFF', journal_mode='MEMORY')
+        previous = {}
+        for name, value in pragmas.items():
+            self.cursor.execute('PRAGMA %s' % name)
+            previous[name] = self.cursor.fetchone()[0]
+            self.cursor.execute('PRAGMA %s = %s' % (name, value))
+            # Some report their new value, which must be read before a commit
+            self.cursor.fetchall()
+
+        start = datetime.now()
+        try:
+            with transaction.atomic(using=self.database):
+                load_table = self.start_sqlite()
+
+                with open_csv(self.csv) as infile:
+                    csv_reader = CSVKitReader(infile)
+                    headers = next(csv_reader)
+                    if self.normalized:
+                        converters = [fields[h].from_normalized_csv for h in headers]
+                    else:
+                        converters = [fields[h].from_csv for h in headers]
+                    insert_sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (
+                        load_table,
+                        ", ".join('"%s"' % h for h in headers),
+                        ", ".join(["%s"] * len(headers)),
+                    )
+
+                    batch = []
+                    for row in csv_reader:
+                        batch.append([
+                            convert(value) for convert, value in zip(converters, row)
+                        ])
+                        if len(batch) == self.sqlite_batch_size:
+                            self.cursor.executemany(insert_sql, batch)
+                            batch = []
+                    if batch:
+                        self.cursor.executemany(insert_sql, batch)
+
+                self.finish_sqlite(load_table)
+        finally:
+            for name, value in previous.items():
+                self.cursor.execute('PRAGMA %s = %s' % (name, value))
+                self.cursor.fetchall()
+        self.copy_duration = datetime.now() - start
 
         # Print out the results
         if self.verbosity > 2:
@@ -277,11 +837,424 @@ class Command(CalAccessCommand):
             model_count = self.model.objects.count()
             self.finish_load_message(model_count, csv_count)
 
+    def start_sqlite(self):
+        """
+        Readies the table the INSERT statements will fill and returns its name.
+        """
+        db_table = self.model._meta.db_table
+        if not self.staging:
+            # Flush the target model
+            self.cursor.execute('DELETE FROM "%s"' % db_table)
+            return db_table
+
+        # SQLite has no CREATE TABLE LIKE, so the copy is made from the table's
+        # own definition. Its indexes wait until the rows are in.
+        staging_table = self.get_staging_name(db_table)
+        self.cursor.execute('DROP TABLE IF EXISTS "%s"' % staging_table)
+        self.cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s",
+            [db_table]
+        )
+        self.cursor.execute(re.sub(
+            r'^CREATE TABLE\s+("[^"]*"|\S+)',
+            'CREATE TABLE "%s"' % staging_table,
+            self.cursor.fetchone()[0],
+            count=1
+        ))
+        return staging_table
+
+    def finish_sqlite(self, staging_table):
+        """
+        Swaps a loaded staging table in for the model's table.
+        """
+        if not self.staging:
+            return
+        db_table = self.model._meta.db_table
+        self.cursor.execute(
+            "SELECT sql FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+            [db_table]
+        )
+        index_sql_list = [row[0] for row in self.cursor.fetchall()]
+        # Like Django's SQLite schema editor, the copy takes the place of the
+        # dropped table and gets its indexes back. Inside the load's transaction,
+        # other connections see the swap happen in a single step.
+        self.cursor.execute('DROP TABLE "%s"' % db_table)
+        self.cursor.execute('ALTER TABLE "%s" RENAME TO "%s"' % (staging_table, db_table))
+        for index_sql in index_sql_list:
+            self.cursor.execute(index_sql)
+
+    def start_mysql(self):
+        """
+        Readies the table LOAD DATA will fill and returns its name.
+        """
+        db_table = self.model._meta.db_table
+        if not self.staging:
+            # Flush the target model
+            self.cursor.execute('TRUNCATE TABLE %s' % db_table)
+            return db_table
+
+        # Create an empty copy of the table, indexes and all
+        staging_table = self.get_staging_name(db_table)
+        self.cursor.execute('DROP TABLE IF EXISTS %s' % staging_table)
+        self.cursor.execute('CREATE TABLE %s LIKE %s' % (staging_table, db_table))
+        return staging_table
+
+    def finish_mysql(self, staging_table):
+        """
+        Swaps a loaded staging table in for the model's table.
+        """
+        if not self.staging:
+            return
+        db_table = self.model._meta.db_table
+        previous_table = "%s_previous" % db_table
+        self.cursor.execute('DROP TABLE IF EXISTS %s' % previous_table)
+        # RENAME TABLE swaps both names in a single atomic operation
+        self.cursor.execute('RENAME TABLE %s TO %s, %s TO %s' % (
+            db_table,
+            previous_table,
+            staging_table,
+            db_table,
+        ))
+        self.cursor.execute('DROP TABLE %s' % previous_table)
+
+    @contextmanager
+    def postgresql_transaction(self):
+        """
+        Runs a PostgreSQL load in a single transaction if it drops the indexes
+        of the model's own table, so a load that fails or is killed part way
+        leaves the table as it was, indexes and all.
+        """
+        if self.defer_indexes and not (self.staging or self.delta):
+            with transaction.atomic(using=self.database):
+                yield
+        else:
+            yield
+
+    def start_postgresql(self):
+        """
+        Readies the table COPY will fill and returns its name.
+
+        Any indexes that must be built once the table is loaded are stored
+        in the deferred_indexes attribute.
+        """
+        db_table = self.model._meta.db_table
+        self.deferred_indexes = []
+
+        # Make sure the functions the copy_templates call are there and up to date
+        install_copy_functions(self.database)
+
+        if self.staging or self.delta:
+            # Create an empty copy of the table with no indexes to maintain.
+            # A delta's is only read by the merge, so its rows are kept out
+            # of the write-ahead log and off any replicas.
+            staging_table = self.get_staging_name(db_table)
+            self.cursor.execute('DROP TABLE IF EXISTS "%s"' % staging_table)
+            self.cursor.execute(
+                'CREATE %sTABLE "%s" (LIKE "%s" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' % (
+                    'UNLOGGED ' if self.delta else '',
+                    staging_table,
+                    db_table,
+                )
+            )
+            # Changes are merged from it into the model's table
+            if self.delta:
+                return staging_table
+
+            # Its indexes get temporary names until it is swapped in
+            for index in self.get_postgresql_indexes(db_table):
+                index['staging_name'] = self.get_staging_name(index['name'])
+                index['sql'] = 'CREATE %sINDEX "%s" ON "%s" %s' % (
+                    'UNIQUE ' if index['unique'] else '',
+                    index['staging_name'],
+                    staging_table,
+                    index['method'],
+                )
+                self.deferred_indexes.append(index)
+            return staging_table
+
+        # Drop all the records from the target model's real table
+        self.cursor.execute('TRUNCATE TABLE "%s" CASCADE' % db_table)
+
+        if self.defer_indexes:
+            # Drop the secondary indexes, which COPY would update row by row.
+            # This runs in the load's transaction, which rebuilds them.
+            for index in self.get_postgresql_indexes(db_table):
+                if index['unique']:
+                    continue
+                index['sql'] = 'CREATE INDEX "%s" ON "%s" %s' % (
+                    index['name'],
+                    db_table,
+                    index['method'],
+                )
+                self.cursor.execute('DROP INDEX "%s"' % index['name'])
+                self.deferred_indexes.append(index)
+        return db_table
+
+    def copy_postgresql(self, copy_mapping):
+        """
+        Runs a COPY into the table readied by start_postgresql, then builds
+        its deferred indexes and swaps it in if it is a staging table.
+        """
+        start = datetime.now()
+        copy_mapping.save(silent=True)
+        self.copy_duration = datetime.now() - start
+
+        if self.delta:
+            self.merge_postgresql(copy_mapping.db_table)
+            return
+
+        self.build_postgresql_indexes()
+        if self.staging:
+            self.swap_postgresql(copy_mapping.db_table)
+
+    def build_postgresql_indexes(self):
+        """
+        Builds the indexes deferred until after COPY, several at a time if
+        there is more than one index worker and they belong to a staging table.
+        """
+        if not self.deferred_indexes:
+            return
+
+        start = datetime.now()
+        sql_list = [index['sql'] for index in self.deferred_indexes]
+        # Other connections can't see into the transaction that rebuilds
+        # the model's own table's indexes
+        if self.index_workers > 1 and self.staging:
+            pool = ThreadPool(processes=min(self.index_workers, len(sql_list)))
+            try:
+                pool.map(build_index, [(self.database, sql) for sql in sql_list])
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for sql in sql_list:
+                self.cursor.execute(sql)
+
+        # Promote the staging table's copy of the primary key index
+        for index in self.deferred_indexes:
+            if index['primary']:
+                self.cursor.execute(
+                    'ALTER TABLE "%s" ADD CONSTRAINT "%s" PRIMARY KEY USING INDEX "%s"' % (
+                        self.get_staging_name(self.model._meta.db_table),
+                        index['staging_name'],
+                        index['staging_name'],
+                    )
+                )
+        self.index_duration = datetime.now() - start
+
+    def swap_postgresql(self, staging_table):
+        """
+        Swaps a loaded and indexed staging table in for the model's table
+        in a single transaction.
+        """
+        db_table = self.model._meta.db_table
+        with transaction.atomic(using=self.database):
+            # The staging table's id default draws on a sequence owned by the
+            # old table, which would otherwise be dropped along with it
+            self.cursor.execute(
+                "SELECT pg_get_serial_sequence(%s, %s)",
+                ['"%s"' % db_table, self.model._meta.pk.column]
+            )
+            sequence = self.cursor.fetchone()[0]
+            if sequence:
+                self.cursor.execute('ALTER SEQUENCE %s OWNED BY "%s"."%s"' % (
+                    sequence,
+                    staging_table,
+                    self.model._meta.pk.column,
+                ))
+            self.cursor.execute('DROP TABLE "%s"' % db_table)
+            self.cursor.execute('ALTER TABLE "%s" RENAME TO "%s"' % (
+                staging_table,
+                db_table,
+            ))
+            for index in self.deferred_indexes:
+                self.cursor.execute('ALTER INDEX "%s" RENAME TO "%s"' % (
+                    index['staging_name'],
+                    index['name'],
+                ))
+
+    def get_postgresql_key(self, alias=''):
+        """
+        Returns a list of the expressions that match a row on the model's
+        UNIQUE_KEY, with its columns prefixed by the table alias.
+
+        A nullable column is matched on its value, with a stand-in for null,
+        and on whether it is null. Unlike IS NOT DISTINCT FROM, both are plain
+        equalities PostgreSQL can match with a hash or merge join rather than
+        comparing every pair of rows in a nested loop.
+        """
+        fields = dict((f.column, f) for f in self.model._meta.fields)
+        expressions = []
+        for column in self.model().get_unique_key_list():
+            field = fields[column]
+            if field.null:
+                expressions.append('COALESCE(%s"%s", %s)' % (
+                    alias,
+                    column,
+                    self.null_key_values.get(field.get_internal_type(), '0'),
+                ))
+                expressions.append('(%s"%s" IS NULL)' % (alias, column))
+            else:
+                expressions.append('%s"%s"' % (alias, column))
+        return expressions
+
+    def get_merge_sql(self, staging_table):
+        """
+        Returns a tuple with the DELETE, UPDATE and INSERT statements that
+        bring the model's table in line with a staging table. The UPDATE is
+        None if the model has no fields outside its UNIQUE_KEY.
+        """
+        db_table = self.model._meta.db_table
+        key_columns = self.model().get_unique_key_list()
+        fields = [f for f in self.model._meta.fields if not f.primary_key]
+        value_columns = [f.column for f in fields if f.column not in key_columns]
+        columns = ", ".join('"%s"' % f.column for f in fields)
+        match_sql = " AND ".join(
+            "%s = %s" % pair for pair in zip(
+                self.get_postgresql_key('s.'),
+                self.get_postgresql_key('l.'),
+            )
+        )
+
+        # Delete rows that are gone from the new file
+        delete_sql = 'DELETE FROM "%s" l WHERE NOT EXISTS (SELECT 1 FROM "%s" s WHERE %s)' % (
+            db_table,
+            staging_table,
+            match_sql,
+        )
+
+        # Update rows whose values have changed
+        update_sql = None
+        if value_columns:
+            update_sql = (
+                'UPDATE "%s" l SET %s FROM "%s" s '
+                'WHERE %s AND (%s) IS DISTINCT FROM (%s)' % (
+                    db_table,
+                    ", ".join('"%s" = s."%s"' % (c, c) for c in value_columns),
+                    staging_table,
+                    match_sql,
+                    ", ".join('l."%s"' % c for c in value_columns),
+                    ", ".join('s."%s"' % c for c in value_columns),
+                )
+            )
+
+        # Insert rows that are new
+        insert_sql = (
+            'INSERT INTO "%s" (%s) SELECT %s FROM "%s" s '
+            'WHERE NOT EXISTS (SELECT 1 FROM "%s" l WHERE %s)' % (
+                db_table,
+                columns,
+                columns,
+                staging_table,
+                db_table,
+                match_sql,
+            )
+        )
+        return delete_sql, update_sql, insert_sql
+
+    def merge_postgresql(self, staging_table):
+        """
+        Applies the differences between a loaded staging table and the
+        model's table in a single transaction, matching rows on the model's
+        UNIQUE_KEY, then drops the staging table.
+
+        If the key turns out not to be unique, the model's table is replaced
+        with the staging table's contents instead.
+        """
+        db_table = self.model._meta.db_table
+        key_columns = self.model().get_unique_key_list()
+        fields = [f for f in self.model._meta.fields if not f.primary_key]
+        columns = ", ".join('"%s"' % f.column for f in fields)
+
+        # Index the staging table on its key now that it is loaded
+        self.cursor.execute('CREATE INDEX "%s" ON "%s" (%s)' % (
+            self.get_staging_name("%s_key" % db_table),
+            staging_table,
+            ", ".join("(%s)" % e for e in self.get_postgresql_key()),
+        ))
+        self.cursor.execute('ANALYZE "%s"' % staging_table)
+        self.cursor.execute(
+            'SELECT 1 FROM "%s" GROUP BY %s HAVING COUNT(*) > 1 LIMIT 1' % (
+                staging_table,
+                ", ".join('"%s"' % c for c in key_columns),
+            )
+        )
+        duplicates = self.cursor.fetchone() is not None
+
+        with transaction.atomic(using=self.database):
+            if not duplicates:
+                delete_sql, update_sql, insert_sql = self.get_merge_sql(staging_table)
+                self.cursor.execute(delete_sql)
+                deleted = self.cursor.rowcount
+                updated = 0
+                if update_sql:
+                    self.cursor.execute(update_sql)
+                    updated = self.cursor.rowcount
+                self.cursor.execute(insert_sql)
+                inserted = self.cursor.rowcount
+
+                # Duplicate keys already in the model's table throw the merge off
+                self.cursor.execute('SELECT COUNT(*) FROM "%s"' % db_table)
+                table_count = self.cursor.fetchone()[0]
+                self.cursor.execute('SELECT COUNT(*) FROM "%s"' % staging_table)
+                duplicates = table_count != self.cursor.fetchone()[0]
+
+            if duplicates:
+                if self.verbosity:
+                    self.failure("  UNIQUE_KEY of %s is not unique. Reloading the whole table." % (
+                        db_table
+                    ))
+                self.cursor.execute('TRUNCATE TABLE "%s" CASCADE' % db_table)
+                self.cursor.execute('INSERT INTO "%s" (%s) SELECT %s FROM "%s"' % (
+                    db_table,
+                    columns,
+                    columns,
+                    staging_table,
+                ))
+            elif self.verbosity > 2:
+                self.log("  %s deleted, %s updated, %s inserted" % (
+                    deleted,
+                    updated,
+                    inserted,
+                ))
+
+        self.cursor.execute('DROP TABLE "%s"' % staging_table)
+
+    def get_postgresql_indexes(self, db_table):
+        """
+        Returns a list of dicts describing the indexes on a PostgreSQL table.
+
+        The method of each index is the part of its definition that follows
+        the table name, like "USING btree (filing_id)".
+        """
+        self.cursor.execute(
+            """
+            SELECT i.relname, pg_get_indexdef(x.indexrelid), x.indisunique, x.indisprimary
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = %s::regclass
+            ORDER BY i.relname
+            """,
+            ['"%s"' % db_table]
+        )
+        return [
+            dict(
+                name=name,
+                method=definition[definition.index(' USING ') + 1:],
+                unique=unique,
+                primary=primary,
+            )
+            for name, definition, unique, primary in self.cursor.fetchall()
+        ]
+
     def get_headers(self):
         """
         Returns the column headers from the csv as a list.
         """
-        with open(self.csv, 'r') as infile:
+        if self.manifest:
+            return self.manifest['headers']
+        with open_csv(self.csv) as infile:
             csv_reader = CSVKitReader(infile)
             try:
                 headers = next(csv_reader)
@@ -293,7 +1266,9 @@ class Command(CalAccessCommand):
         """
         Returns the number of rows in the file, not counting headers.
         """
-        with open(self.csv) as infile:
+        if self.manifest:
+            return self.manifest['rows_count']
+        with open_csv(self.csv) as infile:
             return sum(1 for line in infile) - 1
 
     def finish_load_message(self, model_count, csv_count):
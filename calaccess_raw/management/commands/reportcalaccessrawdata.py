@@ -4,9 +4,10 @@ from __future__ import unicode_literals
 from __future__ import division
 import os
 from calaccess_raw.management.commands import CalAccessCommand
-from calaccess_raw import get_model_list
+from calaccess_raw import get_selected_model_list, get_selected_tsv_names
 from django.conf import settings
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.models import Sum
 from django.forms.models import model_to_dict
 from django.contrib.humanize.templatetags.humanize import naturaltime
@@ -35,10 +36,42 @@ class Command(CalAccessCommand):
         Adds custom arguments specific to this command.
         """
         super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            "--tables",
+            action="store",
+            nargs="+",
+            dest="tables",
+            default=None,
+            metavar="TABLE",
+            help="Verify and report on only these models, named by model or "
+                 "table (defaults to the CALACCESS_TABLES setting)"
+        )
+        parser.add_argument(
+            "--exclude-tables",
+            action="store",
+            nargs="+",
+            dest="exclude_tables",
+            default=None,
+            metavar="TABLE",
+            help="Leave these models out (defaults to the "
+                 "CALACCESS_EXCLUDE_TABLES setting)"
+        )
 
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
 
+        try:
+            self.model_list = get_selected_model_list(
+                options['tables'],
+                options['exclude_tables']
+            )
+            tsv_names = get_selected_tsv_names(
+                options['tables'],
+                options['exclude_tables']
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
         self.missing_raw_files = []
         self.empty_raw_files = []
         self.unknown_raw_files = []
@@ -56,6 +89,10 @@ class Command(CalAccessCommand):
             self.raw_data_files = self.raw_data_files.filter(
                 version=last_complete_download.version
             )
+            if tsv_names is not None:
+                self.raw_data_files = self.raw_data_files.filter(
+                    file_name__in=[x.replace('.TSV', '') for x in tsv_names]
+                )
 
             downloaded_release_datetime = last_complete_download.version.release_datetime
             current_release_datetime = self.get_download_metadata()['last-modified']
@@ -69,9 +106,9 @@ class Command(CalAccessCommand):
         self.log("Analyzing loaded models")
 
         if self.verbosity == 1:
-            model_list = progress.bar(get_model_list())
+            model_list = progress.bar(self.model_list)
         else:
-            model_list = get_model_list()
+            model_list = self.model_list
 
         for model in model_list:
 
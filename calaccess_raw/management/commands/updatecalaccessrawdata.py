@@ -2,20 +2,66 @@
 # -*- coding: utf-8 -*-
 import os
 from datetime import datetime
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from hurry.filesize import size
 from clint.textui import progress
 from django.conf import settings
-from django.core.management import call_command
+from django.db import connections, router
 from django.core.management.base import CommandError
 from django.template.loader import render_to_string
 from django.contrib.humanize.templatetags.humanize import naturaltime
 from calaccess_raw.management.commands import CalAccessCommand
+from calaccess_raw.management.commands.cleancalaccessrawfile import (
+    REPAIR_WINDOW,
+    get_zip_members
+)
 from calaccess_raw import (
     get_download_directory,
     get_test_download_directory,
-    get_model_list
+    get_selected_model_list,
+    get_selected_tsv_names
 )
+from calaccess_raw.metrics import write_metrics
 from calaccess_raw.models.tracking import RawDataVersion
+from calaccess_raw.pipeline import run_command
+
+
+def clean_file(args):
+    """
+    Runs cleancalaccessrawfile on a single file from within a worker process.
+    """
+    name, options = args
+    run_command("cleancalaccessrawfile", name, **options)
+    return name
+
+
+def load_model(args):
+    """
+    Runs loadcalaccessrawfile on a single model from within a worker thread.
+    """
+    model_name, options = args
+    try:
+        run_command("loadcalaccessrawfile", model_name, **options)
+    except Exception as e:
+        # The error is raised again far from this thread, so name the model
+        raise CommandError("Loading %s failed: %s" % (model_name, e))
+    finally:
+        # Django opens a connection for each thread, so close this one's
+        for connection in connections.all():
+            connection.close()
+    return model_name
+
+
+def export_and_load_model(args):
+    """
+    Runs exportcalaccessrawfile on a single model, unless its options are
+    None, and then loadcalaccessrawfile from within a worker thread.
+    """
+    model_name, export_options, load_options = args
+    if export_options is not None:
+        run_command("exportcalaccessrawfile", model_name, **export_options)
+    return load_model((model_name, load_options))
 
 
 class Command(CalAccessCommand):
@@ -61,6 +107,151 @@ class Command(CalAccessCommand):
             default=False,
             help="Download the ZIP archive without asking permission"
         )
+        parser.add_argument(
+            "--download-connections",
+            action="store",
+            type=int,
+            dest="download_connections",
+            default=1,
+            help="Number of byte ranges of the ZIP to download concurrently"
+        )
+        parser.add_argument(
+            "--workers",
+            action="store",
+            type=int,
+            dest="workers",
+            default=1,
+            help="Number of processes that unzip and clean files at the same time"
+        )
+        parser.add_argument(
+            "--shards",
+            action="store",
+            type=int,
+            dest="shards",
+            default=1,
+            help="Number of pieces of each large TSV file to clean in parallel "
+                 "processes (when not cleaning with --workers)"
+        )
+        parser.add_argument(
+            "--repair-window",
+            action="store",
+            type=int,
+            dest="repair_window",
+            default=REPAIR_WINDOW,
+            help="Most lines to join back into a record broken up by line "
+                 "breaks in its values (1 turns off the repair)"
+        )
+        parser.add_argument(
+            "--load-workers",
+            action="store",
+            type=int,
+            dest="load_workers",
+            default=1,
+            help="Number of tables to load at the same time, each on its own "
+                 "database connection (not SQLite)"
+        )
+        parser.add_argument(
+            "--pipeline",
+            action="store_true",
+            dest="pipeline",
+            default=False,
+            help="Load each file as soon as it is cleaned, while the rest are "
+                 "still being cleaned"
+        )
+        parser.add_argument(
+            "--staging",
+            action="store_true",
+            dest="staging",
+            default=False,
+            help="Load each table into a staging table and swap it in when "
+                 "complete, so tables are never empty"
+        )
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            dest="delta",
+            default=False,
+            help="Apply only the rows that changed to each table, matched on "
+                 "its model's UNIQUE_KEY. Tables without a usable UNIQUE_KEY "
+                 "are reloaded in full (PostgreSQL only)"
+        )
+        parser.add_argument(
+            "--defer-indexes",
+            action="store_true",
+            dest="defer_indexes",
+            default=False,
+            help="Drop each table's secondary indexes before loading and "
+                 "rebuild them afterwards (PostgreSQL only)"
+        )
+        parser.add_argument(
+            "--index-workers",
+            action="store",
+            type=int,
+            dest="index_workers",
+            default=1,
+            help="Number of each staging table's indexes to build at the "
+                 "same time (PostgreSQL only)"
+        )
+        parser.add_argument(
+            "--stream-load",
+            action="store_true",
+            dest="stream_load",
+            default=False,
+            help="Clean each TSV file as it is loaded, without writing CSV "
+                 "files (PostgreSQL only)"
+        )
+        parser.add_argument(
+            "--from-zip",
+            action="store_true",
+            dest="from_zip",
+            default=False,
+            help="Clean the TSV files straight out of the downloaded ZIP "
+                 "archive without unzipping them to disk"
+        )
+        parser.add_argument(
+            "--normalize",
+            action="store_true",
+            dest="normalize",
+            default=False,
+            help="Normalize dates, numbers and text while cleaning, so "
+                 "PostgreSQL can copy them straight into each table"
+        )
+        parser.add_argument(
+            "--export-parquet",
+            action="store_true",
+            dest="export_parquet",
+            default=False,
+            help="Export each cleaned CSV file to a compressed Parquet file "
+                 "before loading"
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            dest="incremental",
+            default=False,
+            help="Skip unzipping, cleaning and loading files unchanged since "
+                 "the previously loaded version"
+        )
+        parser.add_argument(
+            "--tables",
+            action="store",
+            nargs="+",
+            dest="tables",
+            default=None,
+            metavar="TABLE",
+            help="Unzip, clean and load only the files of these models, named "
+                 "by model or table (defaults to the CALACCESS_TABLES setting)"
+        )
+        parser.add_argument(
+            "--exclude-tables",
+            action="store",
+            nargs="+",
+            dest="exclude_tables",
+            default=None,
+            metavar="TABLE",
+            help="Skip the files of these models (defaults to the "
+                 "CALACCESS_EXCLUDE_TABLES setting)"
+        )
         parser.add_argument(
             "--test",
             "--use-test-data",
@@ -88,6 +279,42 @@ class Command(CalAccessCommand):
         self.downloading = options['download']
         self.cleaning = options['clean']
         self.loading = options['load']
+        self.incremental = options['incremental']
+        self.workers = max(options['workers'], 1)
+        self.shards = options['shards']
+        self.repair_window = options['repair_window']
+        self.stream_load = options['stream_load']
+        self.from_zip = options['from_zip']
+        self.normalize = options['normalize']
+        self.export_parquet = options['export_parquet']
+        self.load_workers = max(options['load_workers'], 1)
+        self.pipeline = options['pipeline']
+        self.staging = options['staging']
+        self.delta = options['delta']
+        self.defer_indexes = options['defer_indexes']
+        self.index_workers = options['index_workers']
+        self.tables = options['tables']
+        self.exclude_tables = options['exclude_tables']
+        # the models whose files get unzipped, cleaned and loaded
+        try:
+            self.model_list = get_selected_model_list(self.tables, self.exclude_tables)
+            self.tsv_names = get_selected_tsv_names(self.tables, self.exclude_tables)
+        except ValueError as e:
+            raise CommandError(e)
+        # fail before downloading anything if a table can't be merged into
+        if self.delta and self.loading and any(
+            connections[router.db_for_write(model=m)].vendor != 'postgresql'
+            for m in self.model_list
+        ):
+            raise CommandError("--delta is only supported on PostgreSQL.")
+        # SQLite lets one connection write at a time, so its tables load one by one
+        if self.load_workers > 1 and any(
+            connections[router.db_for_write(model=m)].vendor == 'sqlite'
+            for m in self.model_list
+        ):
+            if self.verbosity:
+                self.log("SQLite tables are loaded one at a time.")
+            self.load_workers = 1
 
         if self.test_mode:
             # if using test data, we don't need to download
@@ -191,6 +418,8 @@ class Command(CalAccessCommand):
                 if not self.confirm_proceed(prompt):
                     raise CommandError("Update cancelled")
 
+        # test data is cleaned and loaded without logging
+        self.log_record = None
         if not self.test_mode:
             if self.resume_mode:
                 self.log_record = last_started_update
@@ -206,55 +435,96 @@ class Command(CalAccessCommand):
                         release_datetime=current_release_datetime,
                         size=download_metadata['content-length']
                     )
-                # create a new log record
+                # create a new log record, naming the command rather than
+                # holding onto it so the record can be passed to worker processes
                 self.log_record = self.command_logs.create(
                     version=version,
-                    command=self,
+                    command=str(self),
                     called_by=self.get_caller_log()
                 )
 
-        # if the user could have resumed but didn't
-        force_restart_download = can_resume and not self.resume_mode
-
-        # if not skipping download, and there's a previous download
-        if self.downloading and last_download:
-            # if not forcing a restart
-            if not force_restart_download:
-                # check if version we are updating is last one being downloaded
-                if self.log_record.version == last_download.version:
-                    # if it finished
-                    if last_download.finish_datetime:
-                        self.log('Already downloaded.')
-                        self.downloading = False
-
-        if self.downloading:
-            call_command(
-                "downloadcalaccessrawdata",
-                keep_files=self.keep_files,
-                verbosity=self.verbosity,
-                noinput=True,
-                restart=force_restart_download,
-            )
-            if self.verbosity:
-                self.duration()
+        try:
+            # if the user could have resumed but didn't
+            force_restart_download = can_resume and not self.resume_mode
+
+            # if not skipping download, and there's a previous download
+            if self.downloading and last_download:
+                # if not forcing a restart
+                if not force_restart_download:
+                    # check if version we are updating is last one being downloaded
+                    if self.log_record.version == last_download.version:
+                        # if it finished
+                        if last_download.finish_datetime:
+                            self.log('Already downloaded.')
+                            self.downloading = False
+
+            if self.downloading:
+                run_command(
+                    "downloadcalaccessrawdata",
+                    keep_files=self.keep_files,
+                    verbosity=self.verbosity,
+                    noinput=True,
+                    restart=force_restart_download,
+                    connections=options['download_connections'],
+                    unzip_workers=self.workers,
+                    incremental=self.incremental,
+                    skip_unzip=self.from_zip,
+                    tables=self.tables,
+                    exclude_tables=self.exclude_tables,
+                    caller=self.log_record,
+                )
+                if self.verbosity:
+                    self.duration()
 
-        # execute the other steps that haven't been skipped
-        if options['clean']:
-            self.clean()
-            if self.verbosity:
-                self.duration()
+            if self.from_zip and not os.path.exists(self.zip_path):
+                raise CommandError("ZIP archive does not exist at %s" % self.zip_path)
 
-        if options['load']:
-            self.load()
-            if self.verbosity:
-                self.duration()
+            # files that haven't changed since they were last loaded get skipped
+            if self.incremental and not self.test_mode:
+                self.unchanged_files = self.get_unchanged_files()
+            else:
+                self.unchanged_files = []
+
+            # execute the other steps that haven't been skipped
+            # (streaming loads clean each file on its way into the database)
+            if self.pipeline and options['clean'] and options['load'] and not self.stream_load:
+                # load each file as soon as it is cleaned
+                self.clean_and_load()
+                if self.verbosity:
+                    self.duration()
+            else:
+                if options['clean'] and not self.stream_load:
+                    self.clean()
+                    if self.verbosity:
+                        self.duration()
 
-        if self.verbosity:
-            self.success("Done!")
+                if self.export_parquet and not self.stream_load:
+                    self.export()
+                    if self.verbosity:
+                        self.duration()
 
-        if not self.test_mode:
-            self.log_record.finish_datetime = datetime.now()
-            self.log_record.save()
+                if options['load']:
+                    self.load()
+                    if self.verbosity:
+                        self.duration()
+
+            # once its files are cleaned, the archive is no longer needed
+            if self.from_zip and not self.keep_files:
+                os.remove(self.zip_path)
+
+            if self.verbosity:
+                self.success("Done!")
+
+            if not self.test_mode:
+                # the steps are recorded in detail on their own log records
+                self.record_metrics(self.log_record)
+                self.log_record.finish_datetime = datetime.now()
+                self.log_record.save()
+        finally:
+            # refresh the file monitoring reads, if one is configured,
+            # whether the update finished or failed
+            if self.log_record:
+                write_metrics()
 
     def clean(self):
         """
@@ -264,7 +534,38 @@ class Command(CalAccessCommand):
         if self.verbosity:
             self.header("Cleaning data files")
 
-        tsv_list = os.listdir(self.tsv_dir)
+        tsv_list = self.get_clean_list()
+        options = self.get_clean_options()
+
+        if self.workers > 1:
+            self.clean_in_pool(tsv_list, options)
+            return
+
+        # Loop through all the files in the source directory
+        if self.verbosity:
+            tsv_list = progress.bar(tsv_list)
+        for name in tsv_list:
+            run_command("cleancalaccessrawfile", name, **options)
+
+    def get_tsv_sizes(self):
+        """
+        Returns a dictionary with the size of each source TSV file, keyed by
+        its name.
+        """
+        if self.from_zip:
+            members = get_zip_members(self.zip_path)
+            return dict((name, m.file_size) for name, m in members.items())
+        return dict(
+            (name, os.path.getsize(os.path.join(self.tsv_dir, name)))
+            for name in os.listdir(self.tsv_dir)
+        )
+
+    def get_clean_list(self):
+        """
+        Returns the names of the TSV files still to be cleaned, biggest first.
+        """
+        tsv_sizes = self.get_tsv_sizes()
+        tsv_list = list(tsv_sizes)
 
         if self.resume_mode:
             # get finished clean command logs of last update
@@ -279,17 +580,91 @@ class Command(CalAccessCommand):
             # remove these from tsv_list
             tsv_list = [x for x in tsv_list if x not in prev_cleaned]
 
-        # Loop through all the files in the source directory
+        if self.unchanged_files:
+            tsv_list = [
+                x for x in tsv_list
+                if x.upper().replace('.TSV', '') not in self.unchanged_files
+            ]
+
+        if self.tsv_names is not None:
+            tsv_list = [x for x in tsv_list if x in self.tsv_names]
+
+        # Start with the biggest files so they don't hold up the end of the run
+        tsv_list.sort(key=tsv_sizes.get, reverse=True)
+        return tsv_list
+
+    def get_clean_options(self):
+        """
+        Returns the options cleancalaccessrawfile is called with.
+        """
+        return dict(
+            verbosity=self.verbosity,
+            keep_files=self.keep_files,
+            shards=self.shards,
+            repair_window=self.repair_window,
+            from_zip=self.from_zip,
+            normalize=self.normalize,
+            caller=self.log_record,
+        )
+
+    def clean_in_pool(self, tsv_list, options):
+        """
+        Clean the raw data files in a pool of worker processes.
+        """
+        # Each worker must open its own database connection rather than
+        # inherit the one held open by this process.
+        for connection in connections.all():
+            connection.close()
+
+        pool = Pool(processes=self.workers)
+        try:
+            results = pool.imap_unordered(
+                clean_file,
+                [(name, options) for name in tsv_list]
+            )
+            if self.verbosity:
+                results = progress.bar(results, expected_size=len(tsv_list))
+            for name in results:
+                pass
+        finally:
+            # Every file is done or something went wrong, so stop the workers
+            pool.terminate()
+            pool.join()
+
+    def export(self):
+        """
+        Exports the cleaned up csv files to Parquet files
+        """
         if self.verbosity:
-            tsv_list = progress.bar(tsv_list)
-        for name in tsv_list:
-            call_command(
-                "cleancalaccessrawfile",
-                name,
-                verbosity=self.verbosity,
-                keep_files=self.keep_files,
+            self.header("Exporting data files")
+
+        model_list = [
+            x for x in self.model_list if os.path.exists(x.objects.get_csv_path())
+        ]
+        if self.unchanged_files:
+            model_list = [
+                x for x in model_list if x._meta.db_table not in self.unchanged_files
+            ]
+
+        if self.verbosity:
+            model_list = progress.bar(model_list)
+        for model in model_list:
+            run_command(
+                "exportcalaccessrawfile",
+                model.__name__,
+                **self.get_export_options()
             )
 
+    def get_export_options(self):
+        """
+        Returns the options exportcalaccessrawfile is called with.
+        """
+        return dict(
+            verbosity=self.verbosity,
+            app_name=self.app_name,
+            caller=self.log_record,
+        )
+
     def load(self):
         """
         Loads the cleaned up csv files into the database
@@ -297,9 +672,35 @@ class Command(CalAccessCommand):
         if self.verbosity:
             self.header("Loading data files")
 
-        model_list = [
-            x for x in get_model_list() if os.path.exists(x.objects.get_csv_path())
-        ]
+        if self.stream_load and self.from_zip:
+            members = get_zip_members(self.zip_path)
+            load_sizes = dict(
+                (x, members[x.objects.get_tsv_name()].file_size)
+                for x in self.model_list if x.objects.get_tsv_name() in members
+            )
+        else:
+            load_sizes = dict(
+                (x, os.path.getsize(self.get_load_path(x)))
+                for x in self.model_list if os.path.exists(self.get_load_path(x))
+            )
+        model_list = self.get_load_list(load_sizes)
+        options = self.get_load_options()
+
+        if self.load_workers > 1:
+            self.load_in_pool(model_list, options)
+            return
+
+        if self.verbosity:
+            model_list = progress.bar(model_list)
+        for model in model_list:
+            run_command("loadcalaccessrawfile", model.__name__, **options)
+
+    def get_load_list(self, load_sizes):
+        """
+        Returns the models still to be loaded out of a dictionary with the
+        size of each model's file, biggest first.
+        """
+        model_list = list(load_sizes)
 
         if self.resume_mode:
             # get finished load command logs of last update
@@ -314,13 +715,152 @@ class Command(CalAccessCommand):
             # remove these from model_list
             model_list = [x for x in model_list if x._meta.db_table not in prev_loaded]
 
+        if self.unchanged_files:
+            model_list = [
+                x for x in model_list if x._meta.db_table not in self.unchanged_files
+            ]
+
+        # Start with the biggest files so the longest loads begin first
+        model_list.sort(key=load_sizes.get, reverse=True)
+        return model_list
+
+    def get_load_options(self):
+        """
+        Returns the options loadcalaccessrawfile is called with.
+        """
+        return dict(
+            verbosity=self.verbosity,
+            keep_files=self.keep_files,
+            app_name=self.app_name,
+            from_tsv=self.stream_load,
+            from_zip=self.stream_load and self.from_zip,
+            repair_window=self.repair_window,
+            staging=self.staging,
+            delta=self.delta,
+            defer_indexes=self.defer_indexes,
+            index_workers=self.index_workers,
+            caller=self.log_record,
+        )
+
+    def load_in_pool(self, model_list, options):
+        """
+        Load several models into the database at once from a pool of threads.
+        """
+        pool = ThreadPool(processes=self.load_workers)
+        try:
+            results = pool.imap_unordered(
+                load_model,
+                [(model.__name__, options) for model in model_list]
+            )
+            if self.verbosity:
+                results = progress.bar(results, expected_size=len(model_list))
+            for name in results:
+                pass
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def clean_and_load(self):
+        """
+        Cleans the raw data files in a pool of worker processes and loads
+        each one into the database as soon as it is ready, while the rest
+        are still being cleaned.
+        """
         if self.verbosity:
-            model_list = progress.bar(model_list)
-        for model in model_list:
-            call_command(
-                "loadcalaccessrawfile",
-                model.__name__,
-                verbosity=self.verbosity,
-                keep_files=self.keep_files,
-                app_name=self.app_name,
+            self.header("Cleaning and loading data files")
+
+        tsv_list = self.get_clean_list()
+        tsv_sizes = self.get_tsv_sizes()
+        # Load the files cleaned in an earlier run, and the rest once they're cleaned
+        load_sizes = dict(
+            (x, tsv_sizes[x.objects.get_tsv_name()])
+            for x in self.model_list if x.objects.get_tsv_name() in tsv_list
+        )
+        for x in self.model_list:
+            if x not in load_sizes and os.path.exists(x.objects.get_csv_path()):
+                load_sizes[x] = os.path.getsize(x.objects.get_csv_path())
+        model_list = self.get_load_list(load_sizes)
+        models = dict((x.objects.get_tsv_name(), x) for x in model_list)
+
+        clean_options = self.get_clean_options()
+        export_options = self.get_export_options() if self.export_parquet else None
+        load_options = self.get_load_options()
+
+        # Each worker must open its own database connection rather than
+        # inherit the one held open by this process.
+        for connection in connections.all():
+            connection.close()
+
+        # Start the processes before any threads, which forking doesn't copy safely
+        clean_pool = Pool(processes=self.workers)
+        # A single load at a time runs right here while the workers clean
+        load_pool = ThreadPool(processes=self.load_workers) if self.load_workers > 1 else None
+        try:
+            loads = []
+
+            def start_load(model):
+                if load_pool:
+                    loads.append(load_pool.apply_async(
+                        export_and_load_model,
+                        [(model.__name__, export_options, load_options)]
+                    ))
+                    return
+                if export_options is not None:
+                    run_command("exportcalaccessrawfile", model.__name__, **export_options)
+                run_command("loadcalaccessrawfile", model.__name__, **load_options)
+
+            cleaned = clean_pool.imap_unordered(
+                clean_file,
+                [(name, clean_options) for name in tsv_list]
             )
+            for model in model_list:
+                if model.objects.get_tsv_name() not in tsv_list:
+                    start_load(model)
+
+            if self.verbosity:
+                cleaned = progress.bar(cleaned, expected_size=len(tsv_list))
+            for name in cleaned:
+                if name in models:
+                    start_load(models[name])
+
+            if self.verbosity and loads:
+                self.log("Finishing loads")
+                loads = progress.bar(loads)
+            for result in loads:
+                # Raises any error from the load
+                result.get()
+        finally:
+            # Every file is done or something went wrong, so stop the workers
+            clean_pool.terminate()
+            clean_pool.join()
+            if load_pool:
+                load_pool.terminate()
+                load_pool.join()
+
+    def get_load_path(self, model):
+        """
+        Returns the path to the file the model will be loaded from.
+        """
+        if self.stream_load:
+            return model.objects.get_tsv_path()
+        return model.objects.get_csv_path()
+
+    def get_unchanged_files(self):
+        """
+        Returns the names of the files in the version being updated that match
+        the previously loaded version.
+
+        Their counts are carried forward from the previous version, since
+        the data in the database already reflects them.
+        """
+        unchanged_files = []
+        for raw_file in self.log_record.version.files.all():
+            if raw_file.is_unchanged():
+                raw_file.copy_counts(raw_file.get_previous())
+                raw_file.save()
+                unchanged_files.append(raw_file.file_name)
+
+        if self.verbosity and unchanged_files:
+            self.log("{} files unchanged since last load.".format(len(unchanged_files)))
+
+        return unchanged_files
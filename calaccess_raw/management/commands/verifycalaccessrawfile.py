@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 from django.apps import apps
 from django.db import router
 from django.contrib.humanize.templatetags.humanize import intcomma
+from calaccess_raw import open_csv
 from calaccess_raw.management.commands import CalAccessCommand
 from calaccess_raw.models.tracking import RawDataVersion
 
@@ -58,9 +59,12 @@ class Command(CalAccessCommand):
         try:
             csv_count = raw_file.clean_records_count
         except UnboundLocalError:
-            csv_path = model.objects.get_csv_path()
-            with open(csv_path) as f:
-                csv_count = sum(1 for l in f) - 1
+            manifest = model.objects.get_manifest()
+            if manifest:
+                csv_count = manifest['rows_count']
+            else:
+                with open_csv(model.objects.get_csv_path()) as f:
+                    csv_count = sum(1 for l in f) - 1
 
         if self.verbosity > 1:
             # Report back on how we did
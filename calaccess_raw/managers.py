@@ -3,13 +3,13 @@
 from __future__ import unicode_literals
 import os
 from django.db import models
-from calaccess_raw import get_download_directory
+from calaccess_raw import get_download_directory, get_csv_extension, read_manifest
 
 
 class CalAccessManager(models.Manager):
 
     def get_csv_name(self):
-        return "%s.csv" % self.model._meta.db_table.lower()
+        return "%s%s" % (self.model._meta.db_table.lower(), get_csv_extension())
 
     def get_csv_path(self):
         return os.path.join(
@@ -18,6 +18,9 @@ class CalAccessManager(models.Manager):
             self.get_csv_name()
         )
 
+    def get_manifest(self):
+        return read_manifest(self.get_csv_path())
+
     def get_tsv_name(self):
         return "%s.TSV" % self.model._meta.db_table
 
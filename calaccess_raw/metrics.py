@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Exports the tracking records of updates as Prometheus metrics, in the text
+format read by node_exporter's textfile collector.
+"""
+from __future__ import unicode_literals
+import io
+import os
+import time
+import calendar
+from django.conf import settings
+from django.db.models import Sum
+
+
+def get_timestamp(dt):
+    """
+    Returns a datetime as seconds since the epoch. Naive datetimes are taken
+    to be in local time, which is how the commands record them.
+    """
+    if dt.tzinfo is not None:
+        seconds = calendar.timegm(dt.utctimetuple())
+    else:
+        seconds = time.mktime(dt.timetuple())
+    return seconds + dt.microsecond / 1000000.0
+
+
+def escape_label(value):
+    """
+    Escapes a label value for the Prometheus text format.
+    """
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class MetricsWriter(object):
+    """
+    Collects metrics and their samples and formats them as Prometheus text.
+    """
+    prefix = 'calaccess_raw_'
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, name, kind, help_text, samples):
+        """
+        Adds a metric with a list of (labels, value) samples. Samples without
+        a value are left out, as is a metric with none at all.
+        """
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if samples:
+            self.metrics.append((self.prefix + name, kind, help_text, samples))
+
+    def add_value(self, name, kind, help_text, value):
+        """
+        Adds a metric with a single unlabeled sample.
+        """
+        self.add(name, kind, help_text, [({}, value)])
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        lines = []
+        for name, kind, help_text, samples in self.metrics:
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                if labels:
+                    label_text = '{%s}' % ','.join(
+                        '%s="%s"' % (k, escape_label(v)) for k, v in sorted(labels.items())
+                    )
+                else:
+                    label_text = ''
+                if isinstance(value, float):
+                    value = repr(value)
+                lines.append('%s%s %s' % (name, label_text, value))
+        return '\n'.join(lines) + '\n'
+
+
+def get_seconds(duration):
+    """
+    Returns a timedelta as seconds, or None.
+    """
+    if duration is None:
+        return None
+    return duration.total_seconds()
+
+
+def get_metrics():
+    """
+    Returns the Prometheus metrics for the latest update, each of its tables
+    and the last one to finish, as text.
+    """
+    from calaccess_raw.models.tracking import RawDataCommand, RawDataFile
+    writer = MetricsWriter()
+    updates = RawDataCommand.objects.filter(command='updatecalaccessrawdata')
+    downloads = RawDataCommand.objects.filter(
+        command='downloadcalaccessrawdata',
+        finish_datetime__isnull=False
+    )
+
+    # Counters over every run
+    writer.add_value(
+        'updates_total',
+        'counter',
+        'Updates that have finished.',
+        updates.filter(finish_datetime__isnull=False).count()
+    )
+    writer.add_value(
+        'download_bytes_total',
+        'counter',
+        'Bytes of ZIP archives downloaded by finished downloads.',
+        downloads.aggregate(total=Sum('bytes_in'))['total'] or 0
+    )
+
+    last_success = updates.filter(
+        finish_datetime__isnull=False
+    ).order_by('-finish_datetime').select_related('version').first()
+    if last_success:
+        writer.add_value(
+            'last_success_timestamp_seconds',
+            'gauge',
+            'When the last update to finish did so.',
+            get_timestamp(last_success.finish_datetime)
+        )
+        writer.add_value(
+            'last_success_release_timestamp_seconds',
+            'gauge',
+            'When the CAL-ACCESS version loaded by the last update to finish was released.',
+            get_timestamp(last_success.version.release_datetime)
+        )
+
+    update = updates.order_by('-start_datetime').select_related('version').first()
+    if not update:
+        return writer.render()
+
+    # The latest run, whether or not it finished
+    writer.add_value(
+        'update_start_timestamp_seconds',
+        'gauge',
+        'When the latest update started.',
+        get_timestamp(update.start_datetime)
+    )
+    writer.add_value(
+        'update_finished',
+        'gauge',
+        'Whether the latest update finished.',
+        1 if update.finish_datetime else 0
+    )
+    writer.add_value(
+        'update_release_timestamp_seconds',
+        'gauge',
+        'When the CAL-ACCESS version of the latest update was released.',
+        get_timestamp(update.version.release_datetime)
+    )
+    if update.finish_datetime:
+        writer.add_value(
+            'update_duration_seconds',
+            'gauge',
+            'How long the latest update took.',
+            (update.finish_datetime - update.start_datetime).total_seconds()
+        )
+    writer.add_value(
+        'update_cpu_seconds',
+        'gauge',
+        'Processor time used by the latest update and its worker processes.',
+        get_seconds(update.cpu_time)
+    )
+    writer.add_value(
+        'update_wait_seconds',
+        'gauge',
+        'Time the latest update ran without using the processor.',
+        get_seconds(update.wait_time)
+    )
+    writer.add_value(
+        'update_peak_rss_bytes',
+        'gauge',
+        'Most memory held at once by the process running the latest update.',
+        update.peak_rss
+    )
+    download = downloads.filter(version=update.version).order_by('-finish_datetime').first()
+    if download:
+        writer.add_value(
+            'update_download_bytes',
+            'gauge',
+            'Bytes of the ZIP archive downloaded for the version of the latest update.',
+            download.bytes_in
+        )
+
+    # Each table of the latest run, from the last finished clean and load of its file
+    steps = {}
+    for log_record in update.called.filter(
+        finish_datetime__isnull=False
+    ).order_by('finish_datetime'):
+        steps[(log_record.command, log_record.file_name)] = log_record
+
+    def get_steps(command):
+        return [
+            (file_name, log_record) for (name, file_name), log_record
+            in sorted(steps.items()) if name == command
+        ]
+
+    for step, command in (('clean', 'cleancalaccessrawfile'), ('load', 'loadcalaccessrawfile')):
+        log_records = get_steps(command)
+        writer.add(
+            'table_%s_duration_seconds' % step,
+            'gauge',
+            'How long the latest update took to %s each table\'s file.' % step,
+            [
+                (dict(table=file_name), get_seconds(r.finish_datetime - r.start_datetime))
+                for file_name, r in log_records
+            ]
+        )
+        writer.add(
+            'table_%s_records' % step,
+            'gauge',
+            'Records %s for each table by the latest update.' % (
+                'cleaned' if step == 'clean' else 'loaded'
+            ),
+            [(dict(table=file_name), r.records_count) for file_name, r in log_records]
+        )
+
+    raw_files = RawDataFile.objects.filter(version=update.version).order_by('file_name')
+    writer.add(
+        'table_rejected_lines',
+        'gauge',
+        'Lines of each table\'s file that could not be parsed into records.',
+        [(dict(table=f.file_name), f.clean_errors_count) for f in raw_files]
+    )
+    writer.add(
+        'table_download_bytes',
+        'gauge',
+        'Uncompressed size of each table\'s file in the version of the latest update.',
+        [(dict(table=f.file_name), f.download_file_size) for f in raw_files]
+    )
+    return writer.render()
+
+
+def write_metrics(path=None):
+    """
+    Writes the Prometheus metrics to a file at the path, or the one in the
+    CALACCESS_PROMETHEUS_TEXTFILE setting, if there is one.
+
+    The file is replaced in one step, so it is never read half written.
+
+    Returns the path written to, or None if none is configured.
+    """
+    path = path or getattr(settings, 'CALACCESS_PROMETHEUS_TEXTFILE', None)
+    if not path:
+        return None
+
+    # The collector only reads files ending in .prom, so it skips this one
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with io.open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(get_metrics())
+    if hasattr(os, 'replace'):
+        os.replace(tmp_path, path)
+    else:
+        # Python 2 can only rename, which replaces the file in one step on Unix
+        os.rename(tmp_path, path)
+    return path
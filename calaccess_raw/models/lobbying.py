@@ -2562,15 +2562,16 @@ class LobbyingChgLogCd(CalAccessBaseModel):
         verbose_name="Effective date",
         help_text="This field is undocumented"
     )
+    DOCUMENTCLOUD_PAGES = [
+        DocumentCloud(id='2711614-CalAccessTablesWeb', start_page=91, end_page=92),
+    ]
 
     class Meta:
         app_label = 'calaccess_raw'
         db_table = 'LOBBYING_CHG_LOG_CD'
         verbose_name = 'LOBBYING_CHG_LOG_CD'
         verbose_name_plural = 'LOBBYING_CHG_LOG_CD'
-        DOCUMENTCLOUD_PAGES = [
-            DocumentCloud(id='2711614-CalAccessTablesWeb', start_page=91, end_page=92),
-        ]
+
     def __str__(self):
         return str(self.filer_id)
 
@@ -4229,7 +4230,7 @@ original filing and 1 to 999 amendments.",
         blank=True,
         help_text='Permanent value unique to this item',
     )
-     DOCUMENTCLOUD_PAGES = [
+    DOCUMENTCLOUD_PAGES = [
         DocumentCloud(id='2711614-CalAccessTablesWeb', start_page=107, end_page=109),
     ]
 
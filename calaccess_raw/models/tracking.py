@@ -76,6 +76,13 @@ class RawDataFile(models.Model):
         help_text="Count of records in the loaded from cleaned file into "
                   "calaccess_raw's data model"
     )
+    clean_errors_count = models.IntegerField(
+        null=False,
+        default=0,
+        verbose_name='clean errors count',
+        help_text='Count of lines in the original file that could not be parsed '
+                  'into records while cleaning'
+    )
     download_columns_count = models.IntegerField(
         null=False,
         default=0,
@@ -94,6 +101,29 @@ class RawDataFile(models.Model):
         verbose_name='load columns count',
         help_text='Count of columns on the loaded calaccess_raw data model'
     )
+    download_crc32 = models.BigIntegerField(
+        null=True,
+        verbose_name='download CRC-32',
+        help_text='CRC-32 checksum of the original file, as listed in the '
+                  'central directory of the downloaded .ZIP file'
+    )
+    download_file_size = models.BigIntegerField(
+        null=True,
+        verbose_name='download file size',
+        help_text='Uncompressed size in bytes of the original file, as listed in '
+                  'the central directory of the downloaded .ZIP file'
+    )
+    load_copy_duration = models.DurationField(
+        null=True,
+        verbose_name='load copy duration',
+        help_text='Time spent copying the cleaned file into the database'
+    )
+    load_index_duration = models.DurationField(
+        null=True,
+        verbose_name='load index duration',
+        help_text='Time spent building indexes deferred until after the file '
+                  'was copied into the database'
+    )
 
     class Meta:
         app_label = 'calaccess_raw'
@@ -104,6 +134,57 @@ class RawDataFile(models.Model):
     def __str__(self):
         return self.file_name
 
+    def get_previous(self):
+        """
+        Returns the record of the same file in the preceding version, or None.
+        """
+        return RawDataFile.objects.filter(
+            file_name=self.file_name,
+            version__release_datetime__lt=self.version.release_datetime
+        ).order_by('-version__release_datetime').first()
+
+    def get_last_load(self):
+        """
+        Returns the log of the latest load of the file from a preceding version, or None.
+        """
+        return RawDataCommand.objects.filter(
+            command='loadcalaccessrawfile',
+            file_name=self.file_name,
+            version__release_datetime__lt=self.version.release_datetime
+        ).order_by('-start_datetime').first()
+
+    def is_unchanged(self):
+        """
+        Returns True if the file matches the one that was last loaded into
+        the database and that load finished.
+        """
+        if self.download_crc32 is None:
+            return False
+        last_load = self.get_last_load()
+        if not last_load or not last_load.finish_datetime:
+            return False
+        loaded = RawDataFile.objects.filter(
+            version=last_load.version,
+            file_name=self.file_name
+        ).first()
+        if not loaded:
+            return False
+        return (
+            loaded.download_crc32 == self.download_crc32 and
+            loaded.download_file_size == self.download_file_size and
+            loaded.clean_records_count > 0
+        )
+
+    def copy_counts(self, other):
+        """
+        Copies the record and column counts from another record of the file.
+        """
+        for stage in ('download', 'clean', 'load'):
+            for count in ('records', 'columns'):
+                attr = '%s_%s_count' % (stage, count)
+                setattr(self, attr, getattr(other, attr))
+        self.clean_errors_count = other.clean_errors_count
+
 
 @python_2_unicode_compatible
 class RawDataCommand(models.Model):
@@ -150,6 +231,47 @@ class RawDataCommand(models.Model):
         help_text='Date and time when the given command finished on '
                   'the given version of the raw source data'
     )
+    bytes_in = models.BigIntegerField(
+        null=True,
+        verbose_name='bytes in',
+        help_text='Size in bytes of the data the command read, like the downloaded '
+                  '.ZIP file or the file that was cleaned or loaded'
+    )
+    bytes_out = models.BigIntegerField(
+        null=True,
+        verbose_name='bytes out',
+        help_text='Size in bytes of the files the command wrote, like the unzipped '
+                  'files or the cleaned file'
+    )
+    records_count = models.BigIntegerField(
+        null=True,
+        verbose_name='records count',
+        help_text='Count of records the command cleaned or loaded'
+    )
+    records_per_second = models.FloatField(
+        null=True,
+        verbose_name='records per second',
+        help_text='Count of records the command cleaned or loaded for each second '
+                  'it ran'
+    )
+    cpu_time = models.DurationField(
+        null=True,
+        verbose_name='CPU time',
+        help_text='Processor time used while the command ran, including the '
+                  'worker processes it started'
+    )
+    wait_time = models.DurationField(
+        null=True,
+        verbose_name='wait time',
+        help_text='Time the command ran without using the processor, like waiting '
+                  'on the network, disk or database'
+    )
+    peak_rss = models.BigIntegerField(
+        null=True,
+        verbose_name='peak memory',
+        help_text='Most bytes of memory held at once by the process running the '
+                  'command, as of when it finished'
+    )
 
     class Meta:
         app_label = 'calaccess_raw'
@@ -158,3 +280,24 @@ class RawDataCommand(models.Model):
 
     def __str__(self):
         return self.command
+
+    def pretty_bytes_in(self):
+        if self.bytes_in is None:
+            return None
+        return sizeformat(self.bytes_in)
+    pretty_bytes_in.short_description = 'bytes in'
+    pretty_bytes_in.admin_order_field = 'bytes_in'
+
+    def pretty_bytes_out(self):
+        if self.bytes_out is None:
+            return None
+        return sizeformat(self.bytes_out)
+    pretty_bytes_out.short_description = 'bytes out'
+    pretty_bytes_out.admin_order_field = 'bytes_out'
+
+    def pretty_peak_rss(self):
+        if self.peak_rss is None:
+            return None
+        return sizeformat(self.peak_rss)
+    pretty_peak_rss.short_description = 'peak memory'
+    pretty_peak_rss.admin_order_field = 'peak_rss'
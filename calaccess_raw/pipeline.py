@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs the steps of a CAL-ACCESS update from Python, all in this process.
+
+    >>> from calaccess_raw import pipeline
+    >>> pipeline.run(tables=['RcptCd', 'FilerFilingsCd'], stages=['clean', 'load'])
+"""
+from __future__ import unicode_literals
+import argparse
+from django.core.management import load_command_class
+
+# The steps of an update, in the order they run
+STAGES = ('download', 'clean', 'export', 'load')
+
+# The steps run unless others are asked for
+DEFAULT_STAGES = ('download', 'clean', 'load')
+
+# The default options and positional argument names of each command, by name
+_arguments = {}
+
+
+def get_arguments(command):
+    """
+    Returns a tuple with a dictionary of a command's default options and a
+    list of the names of its positional arguments.
+
+    Each command's arguments are only parsed the first time it is run.
+    """
+    name = str(command)
+    if name not in _arguments:
+        parser = command.create_parser('', name)
+        defaults = dict(
+            (a.dest, a.default) for a in parser._actions
+            if a.default != argparse.SUPPRESS
+        )
+        positionals = [a.dest for a in parser._actions if not a.option_strings]
+        _arguments[name] = (defaults, positionals)
+    defaults, positionals = _arguments[name]
+    return dict(defaults), positionals
+
+
+def run_command(name, *args, **options):
+    """
+    Runs one of this app's management commands, like call_command.
+
+    If a caller keyword argument is provided, it is taken as the RawDataCommand
+    record of the command running this one, which is then used directly rather
+    than looked up.
+
+    Returns the command once it has run, so its attributes can be inspected.
+    """
+    caller = options.pop('caller', None)
+    command = load_command_class('calaccess_raw', name)
+    command.caller_log = caller
+
+    defaults, positionals = get_arguments(command)
+    defaults.update(zip(positionals, args))
+    defaults.update(options)
+    defaults.setdefault('skip_checks', True)
+
+    command.execute(**defaults)
+    return command
+
+
+def run(tables=None, stages=None, **options):
+    """
+    Updates the CAL-ACCESS data in the database, like updatecalaccessrawdata.
+
+    Only the steps in stages, which default to DEFAULT_STAGES, are run. If tables
+    are provided, only those models' files are unzipped, cleaned and loaded.
+    They can be named by either the model or its database table, and default
+    to the CALACCESS_TABLES setting. Any other keyword arguments, like
+    exclude_tables, are options of updatecalaccessrawdata.
+
+    Returns the RawDataCommand record of the update, or None with test data.
+    """
+    stages = DEFAULT_STAGES if stages is None else stages
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError("Unknown stages: %s. Choose from %s." % (
+            ", ".join(sorted(unknown)),
+            ", ".join(STAGES),
+        ))
+
+    options.setdefault('noinput', True)
+    command = run_command(
+        'updatecalaccessrawdata',
+        download='download' in stages,
+        clean='clean' in stages,
+        export_parquet='export' in stages,
+        load='load' in stages,
+        tables=tables,
+        **options
+    )
+    return command.log_record
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import io
+import csv
+import logging
+from csvkit import CSVKitReader, CSVKitWriter
+from django.test import SimpleTestCase
+from calaccess_raw.management.commands.cleancalaccessrawfile import (
+    REPAIR_WINDOW,
+    clean_lines,
+    clean_blocks,
+    read_blocks,
+    read_headers,
+    CleanedStream,
+    LineRepairer,
+)
+logger = logging.getLogger(__name__)
+
+
+class CleanTestCase(SimpleTestCase):
+    """
+    Tests of the routines that clean TSV lines into CSV rows.
+    """
+    tsv = (
+        b'a\tb\tc\r\n'
+        b'nul\x00byte\tsub\x1achar\tcaf\xe9\r\n'
+        b'too\tfew\r\n'
+        b'"quoted\ttab"\tb\tc\r\n'
+        b'unix\tline\tend\n'
+        b'mac\rreturn\tb\tc\r\n'
+        b'no\tline\tbreak'
+    )
+
+    def clean(self, routine):
+        csv_file = io.StringIO()
+        csv_writer = CSVKitWriter(csv_file, quoting=csv.QUOTE_ALL)
+        result = routine(io.BytesIO(self.tsv), csv_writer)
+        return result, csv_file.getvalue()
+
+    def test_clean_blocks(self):
+        """
+        Verify that cleaning by the block matches cleaning line by line.
+        """
+        expected = self.clean(lambda f, w: clean_lines(f, 3, w))
+        self.assertEqual(expected[0][:2], (6, 7))
+        for block_size in (1, 7, 1024):
+            self.assertEqual(
+                self.clean(lambda f, w: clean_blocks(read_blocks(f, block_size=block_size), 3, w)),
+                expected
+            )
+
+    def test_cleaned_stream(self):
+        """
+        Verify that reading a cleaned stream matches cleaning to a file.
+        """
+        (rows_count, lines_count, log_rows), csv_text = self.clean(
+            lambda f, w: clean_blocks(read_blocks(f), 3, w, LineRepairer(3, REPAIR_WINDOW))
+        )
+        for size in (1, 100, -1):
+            tsv_file = io.BytesIO(b'h1\th2\th3\r\n' + self.tsv)
+            stream = CleanedStream(tsv_file, read_headers(tsv_file))
+            stream.blocks = read_blocks(tsv_file, block_size=16)
+            chunks = []
+            while True:
+                chunk = stream.read(size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            self.assertEqual(''.join(chunks), '"h1","h2","h3"\n' + csv_text)
+            self.assertEqual(
+                (stream.rows_count, stream.lines_count, stream.log_rows),
+                (rows_count, lines_count, log_rows)
+            )
+
+    def test_repair(self):
+        """
+        Verify that records broken up by line breaks are joined back together.
+        """
+        tsv = (
+            b'a\tb\tc\r\n'
+            b'split\tval\r\n'
+            b'ue\tc\r\n'
+            b'too\tfew\r\n'
+            b'a\tb\tc\r\n'
+            b'x\r\n'
+            b'y\r\n'
+            b'z\tb\tc\n'
+            b'last\tshort'
+        )
+
+        def clean(routine):
+            csv_file = io.StringIO()
+            csv_writer = CSVKitWriter(csv_file, quoting=csv.QUOTE_ALL)
+            result = routine(io.BytesIO(tsv), csv_writer)
+            return result, csv_file.getvalue()
+
+        for window in (1, 2, REPAIR_WINDOW):
+            expected = clean(lambda f, w: clean_lines(f, 3, w, LineRepairer(3, window)))
+            for block_size in (1, 7, 1024):
+                self.assertEqual(
+                    clean(lambda f, w: clean_blocks(
+                        read_blocks(f, block_size=block_size),
+                        3,
+                        w,
+                        LineRepairer(3, window)
+                    )),
+                    expected
+                )
+
+        (rows_count, lines_count, log_rows), csv_text = expected
+        self.assertEqual((rows_count, lines_count), (4, 9))
+        self.assertEqual([row[3] for row in log_rows], ['too,few', 'last,short'])
+        self.assertEqual(list(CSVKitReader(io.StringIO(csv_text))), [
+            ['a', 'b', 'c'],
+            ['split', 'val\nue', 'c'],
+            ['a', 'b', 'c'],
+            ['x\ny\nz', 'b', 'c\n'],
+        ])
@@ -1,14 +1,56 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import io
+import os
+import shutil
+import hashlib
 import logging
-from django.test import TestCase
-from calaccess_raw import get_model_list
+import zipfile
+import tempfile
+from csvkit import CSVKitReader
+from django.db import connection, DataError
+from django.test import TestCase, TransactionTestCase
+from datetime import datetime
+from django.utils.timezone import utc
+from calaccess_raw import (
+    get_model_list,
+    get_selected_model_list,
+    get_download_directory,
+    get_test_download_directory,
+    open_csv,
+    pipeline
+)
+from calaccess_raw.models import RcptCd, FilersCd, FilerFilingsCd
+from calaccess_raw.models.tracking import RawDataVersion, RawDataFile, RawDataCommand
 from django.test.utils import override_settings
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from calaccess_raw.management.commands import (
+    cleancalaccessrawfile,
+    downloadcalaccessrawdata,
+    loadcalaccessrawfile,
+    updatecalaccessrawdata
+)
 logger = logging.getLogger(__name__)
 
 
+class OfflineUpdateCommand(updatecalaccessrawdata.Command):
+    """
+    An update of a version released at a set time, without asking the state's server.
+    """
+    release_datetime = datetime(2016, 3, 1, tzinfo=utc)
+
+    def __str__(self):
+        return 'updatecalaccessrawdata'
+
+    def get_download_metadata(self):
+        return {
+            'content-length': 100,
+            'last-modified': self.release_datetime,
+        }
+
+
 class CommandTestCase(TestCase):
     """
     Tests related to the management commands that update the database.
@@ -45,3 +87,602 @@ class CommandTestCase(TestCase):
         Test that totalcalaccessrawdata management command is working.
         """
         call_command("totalcalaccessrawdata")
+
+    def test_cleancalaccessrawfile_shards(self):
+        """
+        Test that cleaning a file in shards matches cleaning it in one piece.
+        """
+        csv_path = RcptCd.objects.get_csv_path()
+        with io.open(csv_path, 'rb') as f:
+            serial = f.read()
+
+        min_shard_size = cleancalaccessrawfile.Command.min_shard_size
+        cleancalaccessrawfile.Command.min_shard_size = 1024
+        try:
+            call_command(
+                "cleancalaccessrawfile",
+                RcptCd.objects.get_tsv_name(),
+                keep_files=True,
+                shards=4,
+            )
+        finally:
+            cleancalaccessrawfile.Command.min_shard_size = min_shard_size
+
+        with io.open(csv_path, 'rb') as f:
+            self.assertEqual(f.read(), serial)
+
+    def test_cleancalaccessrawfile_gzip(self):
+        """
+        Test that a gzipped CSV has the same contents and loads the same records.
+        """
+        with io.open(RcptCd.objects.get_csv_path(), 'rb') as f:
+            serial = f.read()
+        count = RcptCd.objects.count()
+
+        with override_settings(CALACCESS_CSV_COMPRESSION='gzip'):
+            csv_path = RcptCd.objects.get_csv_path()
+            self.assertTrue(csv_path.endswith('.csv.gz'))
+            try:
+                call_command(
+                    "cleancalaccessrawfile",
+                    RcptCd.objects.get_tsv_name(),
+                    keep_files=True,
+                )
+                with open_csv(csv_path, 'rb') as f:
+                    self.assertEqual(f.read(), serial)
+
+                call_command("loadcalaccessrawfile", "RcptCd", keep_files=True)
+                self.assertEqual(RcptCd.objects.count(), count)
+                call_command("verifycalaccessrawfile", "RcptCd")
+            finally:
+                os.path.exists(csv_path) and os.remove(csv_path)
+
+    def test_cleancalaccessrawfile_from_zip(self):
+        """
+        Test that cleaning a file straight out of the ZIP matches cleaning it from disk.
+        """
+        csv_path = RcptCd.objects.get_csv_path()
+        with io.open(csv_path, 'rb') as f:
+            serial = f.read()
+
+        zip_path = os.path.join(get_download_directory(), 'calaccess.zip')
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.write(
+                RcptCd.objects.get_tsv_path(),
+                'CalAccess/DATA/CalAccess/DATA/%s' % RcptCd.objects.get_tsv_name()
+            )
+        try:
+            call_command(
+                "cleancalaccessrawfile",
+                RcptCd.objects.get_tsv_name(),
+                from_zip=True,
+            )
+        finally:
+            os.remove(zip_path)
+
+        self.assertTrue(os.path.exists(RcptCd.objects.get_tsv_path()))
+        with io.open(csv_path, 'rb') as f:
+            self.assertEqual(f.read(), serial)
+
+    def test_cleancalaccessrawfile_manifest(self):
+        """
+        Test that the manifest written alongside a clean CSV describes it.
+        """
+        csv_path = RcptCd.objects.get_csv_path()
+        manifest = RcptCd.objects.get_manifest()
+        with io.open(csv_path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(manifest['size'], len(data))
+        self.assertEqual(manifest['sha256'], hashlib.sha256(data).hexdigest())
+        with open_csv(csv_path) as f:
+            self.assertEqual(manifest['headers'], next(CSVKitReader(f)))
+        self.assertEqual(manifest['rows_count'], RcptCd.objects.count())
+
+        # A file that has changed since doesn't match its manifest
+        with io.open(csv_path, 'ab') as f:
+            f.write(b'\r\n')
+        try:
+            self.assertIsNone(RcptCd.objects.get_manifest())
+        finally:
+            with io.open(csv_path, 'wb') as f:
+                f.write(data)
+
+    def test_cleancalaccessrawfile_normalize(self):
+        """
+        Test that a normalized CSV loads the same records as a raw one.
+        """
+        order = ('filing_id', 'amend_id', 'line_item', 'rec_type', 'form_type')
+        columns = order + ('rcpt_date', 'amount')
+        rows = list(RcptCd.objects.order_by(*order).values_list(*columns))
+        try:
+            call_command(
+                "cleancalaccessrawfile",
+                RcptCd.objects.get_tsv_name(),
+                keep_files=True,
+                normalize=True,
+            )
+            self.assertTrue(RcptCd.objects.get_manifest()['normalized'])
+            call_command("loadcalaccessrawfile", "RcptCd", keep_files=True)
+            reloaded = RcptCd.objects.order_by(*order).values_list(*columns)
+            self.assertEqual(list(reloaded), rows)
+        finally:
+            call_command(
+                "cleancalaccessrawfile",
+                RcptCd.objects.get_tsv_name(),
+                keep_files=True,
+            )
+
+    def test_updatecalaccessrawdata_pipeline(self):
+        """
+        Test that loading each file as soon as it is cleaned loads the same records.
+        """
+        counts = dict((m, m.objects.count()) for m in get_model_list())
+        call_command(
+            "updatecalaccessrawdata",
+            test_data=True,
+            noinput=True,
+            verbosity=0,
+            pipeline=True,
+            workers=2,
+        )
+        self.assertEqual(
+            dict((m, m.objects.count()) for m in get_model_list()),
+            counts
+        )
+
+    def test_updatecalaccessrawdata_failure_metrics(self):
+        """
+        Test that an update that fails still refreshes the Prometheus textfile.
+        """
+        class FailingCommand(OfflineUpdateCommand):
+            def clean(self):
+                raise CommandError("Cleaning failed")
+
+        data_dir = tempfile.mkdtemp()
+        path = os.path.join(data_dir, 'calaccess.prom')
+        try:
+            with override_settings(
+                CALACCESS_DOWNLOAD_DIR=data_dir,
+                CALACCESS_PROMETHEUS_TEXTFILE=path
+            ):
+                with self.assertRaises(CommandError):
+                    call_command(FailingCommand(), verbosity=0, noinput=True, download=False)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        finally:
+            shutil.rmtree(data_dir)
+
+        self.assertIn('calaccess_raw_update_finished 0', lines)
+        self.assertIn('calaccess_raw_update_release_timestamp_seconds 1456790400.0', lines)
+
+    def test_pipeline_run(self):
+        """
+        Test that the pipeline cleans and loads just the tables and stages asked for.
+        """
+        count = RcptCd.objects.count()
+        log_record = pipeline.run(
+            tables=['RcptCd'],
+            stages=['clean', 'load'],
+            test_data=True,
+            verbosity=0,
+        )
+        self.assertIsNone(log_record)
+        self.assertEqual(RcptCd.objects.count(), count)
+        with self.assertRaises(ValueError):
+            pipeline.run(stages=['unzip'], test_data=True)
+
+    def test_pipeline_caller(self):
+        """
+        Test that a command run by the pipeline is logged under the caller it is handed.
+        """
+        version = RawDataVersion.objects.create(
+            release_datetime=datetime(2016, 3, 1, tzinfo=utc),
+            size=100
+        )
+        caller = RawDataCommand.objects.create(
+            version=version,
+            command='updatecalaccessrawdata'
+        )
+        pipeline.run_command(
+            "loadcalaccessrawfile",
+            "RcptCd",
+            keep_files=True,
+            verbosity=0,
+            caller=caller,
+        )
+        log_record = caller.called.get()
+        self.assertEqual(log_record.command, 'loadcalaccessrawfile')
+        self.assertEqual(log_record.version, version)
+        self.assertIsNotNone(log_record.finish_datetime)
+
+    def test_command_metrics(self):
+        """
+        Test that cleaning and loading a file record how much they handled and what it took.
+        """
+        version = RawDataVersion.objects.create(
+            release_datetime=datetime(2016, 3, 1, tzinfo=utc),
+            size=100
+        )
+        caller = RawDataCommand.objects.create(
+            version=version,
+            command='updatecalaccessrawdata'
+        )
+        for command in ("cleancalaccessrawfile", "loadcalaccessrawfile"):
+            pipeline.run_command(
+                command,
+                RcptCd.objects.get_tsv_name() if command.startswith('clean') else 'RcptCd',
+                keep_files=True,
+                verbosity=0,
+                caller=caller,
+            )
+
+        clean_log = caller.called.get(command='cleancalaccessrawfile')
+        self.assertEqual(clean_log.bytes_in, os.path.getsize(RcptCd.objects.get_tsv_path()))
+        self.assertEqual(clean_log.bytes_out, os.path.getsize(RcptCd.objects.get_csv_path()))
+        self.assertEqual(clean_log.records_count, RcptCd.objects.count())
+
+        load_log = caller.called.get(command='loadcalaccessrawfile')
+        self.assertEqual(load_log.bytes_in, os.path.getsize(RcptCd.objects.get_csv_path()))
+        self.assertIsNone(load_log.bytes_out)
+        self.assertEqual(load_log.records_count, RcptCd.objects.count())
+
+        for log_record in (clean_log, load_log):
+            self.assertGreater(log_record.records_per_second, 0)
+            self.assertIsNotNone(log_record.cpu_time)
+            self.assertIsNotNone(log_record.wait_time)
+            self.assertGreater(log_record.peak_rss, 0)
+
+    def test_get_selected_model_list(self):
+        """
+        Test that tables can be picked and left out by model or table name.
+        """
+        self.assertEqual(
+            get_selected_model_list(['RcptCd', 'FILERS_CD']),
+            [m for m in get_model_list() if m in (RcptCd, FilersCd)]
+        )
+        with override_settings(CALACCESS_EXCLUDE_TABLES=['RCPT_CD']):
+            model_list = get_selected_model_list()
+            self.assertNotIn(RcptCd, model_list)
+            self.assertEqual(len(model_list), len(get_model_list()) - 1)
+            # Options take the place of the setting
+            self.assertIn(RcptCd, get_selected_model_list(exclude_tables=[]))
+        with self.assertRaises(ValueError):
+            get_selected_model_list(['NotATable'])
+
+    def test_downloadcalaccessrawdata_unzip_tables(self):
+        """
+        Test that only the files of the tables picked are unzipped and recorded.
+        """
+        version = RawDataVersion.objects.create(
+            release_datetime=datetime(2016, 3, 1, tzinfo=utc),
+            size=100
+        )
+        data_dir = tempfile.mkdtemp()
+        command = downloadcalaccessrawdata.Command()
+        command.verbosity = 0
+        command.no_color = True
+        command.raw_data_files = RawDataFile.objects
+        command.log_record = RawDataCommand.objects.create(
+            version=version,
+            command='downloadcalaccessrawdata'
+        )
+        command.zip_path = os.path.join(data_dir, 'calaccess.zip')
+        command.tsv_dir = os.path.join(data_dir, 'tsv/')
+        command.unzip_workers = 1
+        command.incremental = False
+        command.tsv_names = set(['RCPT_CD.TSV'])
+        try:
+            with zipfile.ZipFile(command.zip_path, 'w') as zf:
+                for name in ('RCPT_CD.TSV', 'FILERS_CD.TSV'):
+                    zf.writestr(command.zip_data_dir + name, 'A\tB\r\n1\t2\r\n')
+            command.unzip()
+            self.assertEqual(os.listdir(command.tsv_dir), ['RCPT_CD.TSV'])
+        finally:
+            shutil.rmtree(data_dir)
+        self.assertEqual(
+            list(version.files.values_list('file_name', flat=True)),
+            ['RCPT_CD']
+        )
+
+    def test_loadcalaccessrawfile_staging(self):
+        """
+        Test that loading through a staging table swaps in the same records.
+        """
+        db_table = RcptCd._meta.db_table
+        count = RcptCd.objects.count()
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, db_table)
+        call_command(
+            "loadcalaccessrawfile",
+            "RcptCd",
+            keep_files=True,
+            staging=True,
+        )
+        self.assertEqual(RcptCd.objects.count(), count)
+        # The swapped in table keeps the indexes and leaves no copy behind
+        with connection.cursor() as cursor:
+            self.assertEqual(
+                connection.introspection.get_constraints(cursor, db_table),
+                constraints
+            )
+        staging_table = loadcalaccessrawfile.Command().get_staging_name(db_table)
+        self.assertNotIn(staging_table, connection.introspection.table_names())
+
+    def test_loadcalaccessrawfile_staging_name(self):
+        """
+        Test that staging names fit PostgreSQL's limit without running together.
+        """
+        command = loadcalaccessrawfile.Command()
+        self.assertEqual(command.get_staging_name('RCPT_CD'), 'RCPT_CD_staging')
+        first = command.get_staging_name('A' * 60 + '_1')
+        second = command.get_staging_name('A' * 60 + '_2')
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(first), 63)
+        self.assertTrue(first.endswith('_staging'))
+
+    def test_loadcalaccessrawfile_defer_indexes(self):
+        """
+        Test that deferring indexes puts back the same records and indexes.
+        """
+        if connection.vendor != 'postgresql':
+            return
+        count = RcptCd.objects.count()
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_indexes(
+                cursor,
+                RcptCd._meta.db_table
+            )
+        call_command(
+            "loadcalaccessrawfile",
+            "RcptCd",
+            keep_files=True,
+            defer_indexes=True,
+        )
+        self.assertEqual(RcptCd.objects.count(), count)
+        with connection.cursor() as cursor:
+            self.assertEqual(
+                connection.introspection.get_indexes(cursor, RcptCd._meta.db_table),
+                indexes
+            )
+
+    def test_loadcalaccessrawfile_defer_indexes_failure(self):
+        """
+        Test that a load that fails after dropping indexes leaves the table as it was.
+        """
+        if connection.vendor != 'postgresql':
+            return
+        count = RcptCd.objects.count()
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_indexes(
+                cursor,
+                RcptCd._meta.db_table
+            )
+
+        # A file with an amount that can't be read as a number
+        with open_csv(RcptCd.objects.get_csv_path()) as f:
+            headers = next(CSVKitReader(f))
+        csv_path = os.path.join(tempfile.mkdtemp(), 'rcpt_cd.csv')
+        with io.open(csv_path, 'w', encoding='utf-8') as f:
+            f.write(','.join(headers) + '\n')
+            f.write(','.join('bad' if h == 'AMOUNT' else '' for h in headers) + '\n')
+        try:
+            with self.assertRaises(DataError):
+                call_command(
+                    "loadcalaccessrawfile",
+                    "RcptCd",
+                    csv=csv_path,
+                    keep_files=True,
+                    defer_indexes=True,
+                )
+        finally:
+            shutil.rmtree(os.path.dirname(csv_path))
+
+        self.assertEqual(RcptCd.objects.count(), count)
+        with connection.cursor() as cursor:
+            self.assertEqual(
+                connection.introspection.get_indexes(cursor, RcptCd._meta.db_table),
+                indexes
+            )
+
+    def test_loadcalaccessrawfile_delta(self):
+        """
+        Test that a delta load changes only the rows that differ from the file.
+        """
+        if connection.vendor != 'postgresql':
+            # Other databases can't merge the rows, so the option is refused
+            with self.assertRaises(CommandError):
+                call_command("loadcalaccessrawfile", "RcptCd", keep_files=True, delta=True)
+            with self.assertRaises(CommandError):
+                call_command("updatecalaccessrawdata", test_data=True, noinput=True, delta=True)
+            return
+        order = ('filing_id', 'amend_id', 'line_item', 'rec_type', 'form_type')
+        rows = list(RcptCd.objects.order_by(*order).values())
+        # Knock the table out of step with the file
+        RcptCd.objects.filter(id=rows[0]['id']).delete()
+        RcptCd.objects.filter(id=rows[1]['id']).update(amount=-1)
+        call_command(
+            "loadcalaccessrawfile",
+            "RcptCd",
+            keep_files=True,
+            delta=True,
+        )
+        reloaded = list(RcptCd.objects.order_by(*order).values())
+        self.assertEqual(len(reloaded), len(rows))
+        # The untouched rows keep their ids
+        self.assertEqual(reloaded[2:], rows[2:])
+        self.assertEqual(reloaded[1]['amount'], rows[1]['amount'])
+
+    def test_loadcalaccessrawfile_delta_plan(self):
+        """
+        Test that a delta load matches rows with joins that don't compare every pair.
+        """
+        if connection.vendor != 'postgresql':
+            return
+        command = loadcalaccessrawfile.Command()
+        with connection.cursor() as cursor:
+            # A nested loop is only planned if there is no other way
+            cursor.execute('SET LOCAL enable_nestloop = off')
+            # Their UNIQUE_KEYs are all or partly the nullable FILER_ID
+            for model in (FilersCd, FilerFilingsCd):
+                command.model = model
+                db_table = model._meta.db_table
+                staging_table = command.get_staging_name(db_table)
+                cursor.execute('CREATE TEMPORARY TABLE "%s" AS SELECT * FROM "%s"' % (
+                    staging_table,
+                    db_table,
+                ))
+                for sql in command.get_merge_sql(staging_table):
+                    if sql is None:
+                        continue
+                    cursor.execute('EXPLAIN ' + sql)
+                    plan = "\n".join(row[0] for row in cursor.fetchall())
+                    self.assertNotIn('Nested Loop', plan)
+
+    def test_exportcalaccessrawfile(self):
+        """
+        Test that exportcalaccessrawfile writes a typed Parquet file.
+        """
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            return
+        call_command("exportcalaccessrawfile", "RcptCd")
+        table = pyarrow.parquet.read_table(
+            os.path.join(get_download_directory(), "parquet", "rcpt_cd.parquet")
+        )
+        self.assertEqual(table.num_rows, RcptCd.objects.count())
+        self.assertEqual(str(table.schema.field('RCPT_DATE').type), 'date32[day]')
+
+    def test_exportcalaccessrawfile_empty_values(self):
+        """
+        Test that empty values of fields that can't be null are exported as nulls.
+        """
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            return
+        with open_csv(RcptCd.objects.get_csv_path()) as f:
+            headers = next(CSVKitReader(f))
+        data_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(CALACCESS_DOWNLOAD_DIR=data_dir):
+                os.makedirs(os.path.join(data_dir, 'csv'))
+                with open_csv(RcptCd.objects.get_csv_path(), 'wb') as f:
+                    f.write((','.join(headers) + '\n').encode('utf-8'))
+                    f.write((',' * (len(headers) - 1) + '\n').encode('utf-8'))
+                call_command("exportcalaccessrawfile", "RcptCd")
+                table = pyarrow.parquet.read_table(
+                    os.path.join(data_dir, "parquet", "rcpt_cd.parquet")
+                )
+        finally:
+            shutil.rmtree(data_dir)
+        self.assertEqual(table.num_rows, 1)
+        self.assertTrue(all(field.nullable for field in table.schema))
+        row = table.to_pydict()
+        self.assertIsNone(row['FILING_ID'][0])
+        self.assertEqual(row['FORM_TYPE'][0], '')
+
+
+class WorkersTestCase(TransactionTestCase):
+    """
+    Tests of the worker processes, which need to share the database outside
+    of a test's transaction.
+    """
+    tables = ['RcptCd', 'FilersCd', 'FilerFilingsCd']
+
+    def update(self, release_datetime, **options):
+        """
+        Updates the tables from the test data as a logged version and returns
+        their cleaned files and the counts recorded for them.
+        """
+        command = OfflineUpdateCommand()
+        command.release_datetime = release_datetime
+        with override_settings(CALACCESS_DOWNLOAD_DIR=get_test_download_directory()):
+            call_command(
+                command,
+                verbosity=0,
+                noinput=True,
+                download=False,
+                keep_files=True,
+                tables=self.tables,
+                **options
+            )
+            model_list = get_selected_model_list(self.tables)
+            csvs = {}
+            for model in model_list:
+                with io.open(model.objects.get_csv_path(), 'rb') as f:
+                    csvs[model] = f.read()
+        counts = list(RawDataFile.objects.filter(
+            version__release_datetime=release_datetime
+        ).order_by('file_name').values_list(
+            'file_name',
+            'download_records_count',
+            'download_columns_count',
+            'clean_records_count',
+            'clean_columns_count',
+            'clean_errors_count',
+        ))
+        self.assertEqual(len(counts), len(model_list))
+        return csvs, counts
+
+    def test_updatecalaccessrawdata_load_workers(self):
+        """
+        Test that loading tables in worker threads matches loading them one at a time.
+        """
+        model_list = get_selected_model_list(self.tables)
+        serial_counts = self.update(datetime(2016, 3, 1, tzinfo=utc))[1]
+        serial_rows = dict((m, m.objects.count()) for m in model_list)
+        for model in model_list:
+            model.objects.all().delete()
+
+        counts = self.update(datetime(2016, 3, 2, tzinfo=utc), load_workers=2)[1]
+        self.assertEqual(counts, serial_counts)
+        self.assertEqual(dict((m, m.objects.count()) for m in model_list), serial_rows)
+
+    def test_updatecalaccessrawdata_load_workers_error(self):
+        """
+        Test that a table failing to load in a worker thread stops the update with a CommandError.
+        """
+        # SQLite tables are loaded one at a time, without worker threads
+        if connection.vendor == 'sqlite':
+            return
+        data_dir = tempfile.mkdtemp()
+        tsv_dir = os.path.join(data_dir, 'tsv')
+        os.makedirs(tsv_dir)
+        test_tsv_dir = os.path.join(get_test_download_directory(), 'tsv')
+        shutil.copy(os.path.join(test_tsv_dir, FilersCd.objects.get_tsv_name()), tsv_dir)
+        # A receipt with an amount that can't be read as a number
+        with io.open(os.path.join(test_tsv_dir, RcptCd.objects.get_tsv_name()), 'rb') as f:
+            header = f.readline()
+            values = f.readline().split(b'\t')
+        values[header.split(b'\t').index(b'AMOUNT')] = b'bad'
+        with io.open(os.path.join(tsv_dir, RcptCd.objects.get_tsv_name()), 'wb') as f:
+            f.write(header + b'\t'.join(values))
+
+        try:
+            with override_settings(CALACCESS_DOWNLOAD_DIR=data_dir):
+                with self.assertRaises(CommandError) as context:
+                    call_command(
+                        OfflineUpdateCommand(),
+                        verbosity=0,
+                        noinput=True,
+                        download=False,
+                        keep_files=True,
+                        tables=['RcptCd', 'FilersCd'],
+                        load_workers=2,
+                    )
+        finally:
+            shutil.rmtree(data_dir)
+        self.assertIn('RcptCd', str(context.exception))
+
+    def test_updatecalaccessrawdata_workers(self):
+        """
+        Test that cleaning files in worker processes matches cleaning them one at a time.
+        """
+        serial_csvs, serial_counts = self.update(datetime(2016, 3, 1, tzinfo=utc))
+        csvs, counts = self.update(datetime(2016, 3, 2, tzinfo=utc), workers=2)
+        self.assertEqual(csvs, serial_csvs)
+        # Each worker process writes to its own copy of an in-memory SQLite database
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            return
+        self.assertEqual(counts, serial_counts)
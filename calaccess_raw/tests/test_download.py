@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import re
+import json
+import shutil
+import logging
+import zipfile
+import tempfile
+import threading
+from django.test import SimpleTestCase
+from django.utils.six.moves import BaseHTTPServer
+from calaccess_raw.management.commands.downloadcalaccessrawdata import (
+    Command,
+    extract_member,
+)
+logger = logging.getLogger(__name__)
+
+# A few megabytes of bytes that are easy to tell apart by offset
+PAYLOAD = bytes(bytearray(i % 251 for i in range(3 * 1024 * 1024 + 17)))
+
+
+class RangeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    A stand-in for the Secretary of State's server that honors byte ranges.
+    """
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2) or len(PAYLOAD) - 1)
+            body = PAYLOAD[start:end + 1]
+            self.send_response(206)
+            self.send_header(
+                'Content-Range',
+                'bytes %s-%s/%s' % (start, end, len(PAYLOAD))
+            )
+        else:
+            body = PAYLOAD
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTestCase(SimpleTestCase):
+    """
+    Tests of the segmented download against a local HTTP server.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super(DownloadTestCase, cls).setUpClass()
+        cls.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever)
+        cls.server_thread.daemon = True
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(DownloadTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.command = Command()
+        self.command.url = 'http://127.0.0.1:%s/dbwebexport.zip' % self.server.server_port
+        self.command.verbosity = 0
+        self.command.no_color = True
+        self.command.zip_path = os.path.join(self.data_dir, 'calaccess.zip')
+        self.command.segments_path = self.command.zip_path + '.segments'
+        self.command.current_release_size = len(PAYLOAD)
+        self.command.accept_ranges = True
+        self.command.resume_download = False
+        self.command.chunk_size = 64 * 1024
+        self.command.checkpoint_size = 256 * 1024
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def read_zip(self):
+        with open(self.command.zip_path, 'rb') as fp:
+            return fp.read()
+
+    def test_segmented_download(self):
+        """
+        Verify that concurrent byte ranges reassemble into the original file.
+        """
+        self.command.connections = 4
+        self.command.download()
+        self.assertEqual(self.read_zip(), PAYLOAD)
+        self.assertFalse(os.path.exists(self.command.segments_path))
+
+    def test_segmented_resume(self):
+        """
+        Verify that each segment of an interrupted download picks up where it left off.
+        """
+        self.command.connections = 3
+        segments = self.command.get_segments()
+        # Pretend the first segment finished and the second got partway
+        segments[0]['downloaded'] = segments[0]['end'] - segments[0]['start'] + 1
+        segments[1]['downloaded'] = 1000
+        partial = bytearray(len(PAYLOAD))
+        partial[:segments[0]['end'] + 1] = PAYLOAD[:segments[0]['end'] + 1]
+        second = segments[1]['start']
+        partial[second:second + 1000] = PAYLOAD[second:second + 1000]
+        with open(self.command.zip_path, 'wb') as fp:
+            fp.write(bytes(partial))
+        with open(self.command.segments_path, 'w') as fp:
+            json.dump(segments, fp)
+
+        self.command.resume_download = True
+        self.assertEqual(
+            self.command.get_local_file_size(),
+            segments[0]['downloaded'] + 1000
+        )
+        self.command.download()
+        self.assertEqual(self.read_zip(), PAYLOAD)
+
+    def test_single_stream(self):
+        """
+        Verify that a single connection still downloads the whole file.
+        """
+        self.command.connections = 1
+        self.command.download()
+        self.assertEqual(self.read_zip(), PAYLOAD)
+
+    def test_extract_member(self):
+        """
+        Verify that a member of the ZIP is inflated to the target path.
+        """
+        member_name = Command.zip_data_dir + 'RCPT_CD.TSV'
+        with zipfile.ZipFile(self.command.zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(member_name, PAYLOAD)
+        target_path = os.path.join(self.data_dir, 'RCPT_CD.TSV')
+        name, file_size, elapsed = extract_member(
+            (self.command.zip_path, member_name, target_path)
+        )
+        self.assertEqual((name, file_size), (member_name, len(PAYLOAD)))
+        with open(target_path, 'rb') as fp:
+            self.assertEqual(fp.read(), PAYLOAD)
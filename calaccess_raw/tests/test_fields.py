@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+from decimal import Decimal
+from datetime import date, datetime
+from django.db import connection
+from django.test import TestCase
+from calaccess_raw import fields, install_copy_functions
+logger = logging.getLogger(__name__)
+
+
+class FieldTestCase(TestCase):
+    """
+    Tests of the Python transformations that mirror each field's copy_template.
+    """
+    def test_from_csv(self):
+        """
+        Verify that raw values are converted the same way as the COPY SQL.
+        """
+        cases = (
+            (fields.CharField(), ' Jones ', 'Jones'),
+            (fields.CharField(), None, ''),
+            # Like TRIM in SQL, only spaces are stripped
+            (fields.CharField(), '\n', '\n'),
+            (fields.DateField(), '3/14/2001 12:00:00 AM', date(2001, 3, 14)),
+            (fields.DateField(), ' ', None),
+            (
+                fields.DateTimeField(),
+                '3/14/2001 1:05:09 PM',
+                datetime(2001, 3, 14, 13, 5, 9)
+            ),
+            (fields.DateTimeField(), '', None),
+            (fields.DecimalField(), '12.50', Decimal('12.50')),
+            (fields.DecimalField(), '', Decimal('0.0')),
+            (fields.FloatField(), '1.5', 1.5),
+            (fields.FloatField(), ' ', 0.0),
+            (fields.IntegerField(), ' 42 ', 42),
+            (fields.IntegerField(), '          ', None),
+            (fields.IntegerField(), 'X', 1),
+            (fields.IntegerField(), 'n', 0),
+        )
+        for field, value, expected in cases:
+            self.assertEqual(field.from_csv(value), expected)
+
+    def test_duckdb_type(self):
+        """
+        Verify that fields map to DuckDB column types.
+        """
+        self.assertEqual(fields.CharField(max_length=10).get_duckdb_type(), 'VARCHAR')
+        self.assertEqual(fields.DateField().get_duckdb_type(), 'DATE')
+        self.assertEqual(
+            fields.DecimalField(max_digits=16, decimal_places=2).get_duckdb_type(),
+            'DECIMAL(16, 2)'
+        )
+
+    def test_to_csv(self):
+        """
+        Verify that normalized values read back the same as from_csv's.
+        """
+        cases = (
+            (fields.CharField(), ' Jones ', 'Jones'),
+            (fields.DateField(), '3/14/2001 12:00:00 AM', '2001-03-14'),
+            (fields.DateField(), ' ', ''),
+            (
+                fields.DateTimeField(),
+                '3/14/2001 1:05:09 PM',
+                '2001-03-14 13:05:09'
+            ),
+            (fields.DecimalField(), '', '0.0'),
+            (fields.FloatField(), '1.5', '1.5'),
+            (fields.IntegerField(), 'X', '1'),
+            (fields.IntegerField(), '          ', ''),
+        )
+        for field, value, expected in cases:
+            self.assertEqual(field.to_csv(value), expected)
+            self.assertEqual(
+                field.from_normalized_csv(field.to_csv(value)),
+                field.from_csv(value)
+            )
+        # Values that can't be transformed are left for the database to reject
+        self.assertEqual(fields.DateField().to_csv('never'), 'never')
+
+    def test_copy_functions(self):
+        """
+        Verify that the functions the copy_templates call match the inline SQL.
+        """
+        if connection.vendor != 'postgresql':
+            return
+        install_copy_functions(connection.alias)
+        cases = (
+            (fields.CharField(), (' Jones ', '', None)),
+            (fields.DateField(), ('3/14/2001 12:00:00 AM', ' ', None)),
+            (fields.DateTimeField(), ('3/14/2001 1:05:09 PM', '', None)),
+            (fields.DecimalField(), ('12.50', '', None)),
+            (fields.FloatField(), ('1.5', ' ', None)),
+            (fields.IntegerField(), (' 42 ', '          ', 'X', 'n', None)),
+        )
+        with connection.cursor() as cursor:
+            for field, values in cases:
+                for value in values:
+                    cursor.execute(
+                        'SELECT %s, %s FROM (SELECT %%s::text AS "v") AS t' % (
+                            field.copy_template % dict(name='v'),
+                            field.inline_copy_template % dict(name='v'),
+                        ),
+                        [value]
+                    )
+                    function_value, inline_value = cursor.fetchone()
+                    self.assertEqual(function_value, inline_value)
+
+    def test_copy_functions_inlined(self):
+        """
+        Verify that the functions the copy_templates call are declared no less
+        volatile than their bodies, so the planner inlines them.
+        """
+        if connection.vendor != 'postgresql':
+            return
+        install_copy_functions(connection.alias)
+        cases = (
+            (fields.CharField(), 'calaccess_to_text', 'i'),
+            (fields.DateField(), 'calaccess_to_date', 's'),
+            (fields.DateTimeField(), 'calaccess_to_timestamp', 's'),
+            (fields.DecimalField(), 'calaccess_to_numeric', 'i'),
+            (fields.FloatField(), 'calaccess_to_float', 'i'),
+            (fields.IntegerField(), 'calaccess_to_int', 'i'),
+        )
+        with connection.cursor() as cursor:
+            for field, function, volatility in cases:
+                cursor.execute(
+                    "SELECT provolatile FROM pg_proc WHERE proname = %s",
+                    [function]
+                )
+                self.assertEqual(cursor.fetchone()[0], volatility)
+
+                # An inlined function is replaced by its body in the plan
+                cursor.execute(
+                    'EXPLAIN VERBOSE SELECT %s FROM '
+                    '(SELECT relname::text AS "v" FROM pg_class) AS t' % (
+                        field.copy_template % dict(name='v'),
+                    )
+                )
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                self.assertNotIn(function, plan)
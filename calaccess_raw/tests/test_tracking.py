@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import shutil
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from django.test import TestCase
+from django.utils.timezone import utc
+from calaccess_raw.metrics import write_metrics
+from calaccess_raw.models.tracking import RawDataVersion, RawDataFile, RawDataCommand
+logger = logging.getLogger(__name__)
+
+
+class TrackingTestCase(TestCase):
+    """
+    Tests related to the models that track versions, files and commands.
+    """
+    def setUp(self):
+        self.old_version = RawDataVersion.objects.create(
+            release_datetime=datetime(2016, 3, 1, tzinfo=utc),
+            size=100
+        )
+        self.new_version = RawDataVersion.objects.create(
+            release_datetime=datetime(2016, 3, 2, tzinfo=utc),
+            size=100
+        )
+        self.old_file = RawDataFile.objects.create(
+            version=self.old_version,
+            file_name='RCPT_CD',
+            download_crc32=123456789,
+            download_file_size=1000,
+            download_records_count=10,
+            clean_records_count=10,
+            clean_columns_count=5,
+        )
+        self.old_load = RawDataCommand.objects.create(
+            version=self.old_version,
+            command='loadcalaccessrawfile',
+            file_name='RCPT_CD',
+        )
+        RawDataCommand.objects.filter(id=self.old_load.id).update(
+            finish_datetime=datetime(2016, 3, 1, 1, tzinfo=utc)
+        )
+
+    def test_unchanged_file(self):
+        """
+        Verify that a file matching a loaded file in the previous version is unchanged.
+        """
+        new_file = RawDataFile.objects.create(
+            version=self.new_version,
+            file_name='RCPT_CD',
+            download_crc32=123456789,
+            download_file_size=1000,
+        )
+        self.assertEqual(new_file.get_previous(), self.old_file)
+        self.assertTrue(new_file.is_unchanged())
+
+        new_file.copy_counts(self.old_file)
+        self.assertEqual(new_file.download_records_count, 10)
+        self.assertEqual(new_file.clean_columns_count, 5)
+
+    def test_changed_file(self):
+        """
+        Verify that a different checksum, a missing checksum or an unloaded
+        previous file all count as changes.
+        """
+        new_file = RawDataFile.objects.create(
+            version=self.new_version,
+            file_name='RCPT_CD',
+            download_crc32=987654321,
+            download_file_size=1000,
+        )
+        self.assertFalse(new_file.is_unchanged())
+
+        new_file.download_crc32 = None
+        self.assertFalse(new_file.is_unchanged())
+
+        new_file.download_crc32 = 123456789
+        self.old_file.clean_records_count = 0
+        self.old_file.save()
+        self.assertFalse(new_file.is_unchanged())
+
+    def test_unloaded_file(self):
+        """
+        Verify that a file is not skipped when the previous version was
+        cleaned but its load never finished.
+        """
+        newer_version = RawDataVersion.objects.create(
+            release_datetime=datetime(2016, 3, 3, tzinfo=utc),
+            size=100
+        )
+        new_file = RawDataFile.objects.create(
+            version=self.new_version,
+            file_name='RCPT_CD',
+            download_crc32=987654321,
+            download_file_size=1000,
+            clean_records_count=12,
+        )
+        newer_file = RawDataFile.objects.create(
+            version=newer_version,
+            file_name='RCPT_CD',
+            download_crc32=987654321,
+            download_file_size=1000,
+        )
+        self.assertEqual(newer_file.get_previous(), new_file)
+        self.assertFalse(newer_file.is_unchanged())
+
+        RawDataCommand.objects.create(
+            version=self.new_version,
+            command='loadcalaccessrawfile',
+            file_name='RCPT_CD',
+        )
+        self.assertFalse(newer_file.is_unchanged())
+
+    def test_unchanged_since_skipped_version(self):
+        """
+        Verify that a file skipped in the previous version still matches the last load.
+        """
+        RawDataFile.objects.create(
+            version=self.new_version,
+            file_name='RCPT_CD',
+            download_crc32=123456789,
+            download_file_size=1000,
+            clean_records_count=10,
+        )
+        newer_version = RawDataVersion.objects.create(
+            release_datetime=datetime(2016, 3, 3, tzinfo=utc),
+            size=100
+        )
+        newer_file = RawDataFile.objects.create(
+            version=newer_version,
+            file_name='RCPT_CD',
+            download_crc32=123456789,
+            download_file_size=1000,
+        )
+        self.assertTrue(newer_file.is_unchanged())
+
+    def test_write_metrics(self):
+        """
+        Verify that the Prometheus textfile describes the latest update and its tables.
+        """
+        self.old_file.clean_errors_count = 3
+        self.old_file.save()
+        start = datetime(2016, 3, 2, 1, tzinfo=utc)
+        update = RawDataCommand.objects.create(
+            version=self.old_version,
+            command='updatecalaccessrawdata',
+        )
+        clean = RawDataCommand.objects.create(
+            version=self.old_version,
+            command='cleancalaccessrawfile',
+            called_by=update,
+            file_name='RCPT_CD',
+            records_count=10,
+        )
+        RawDataCommand.objects.filter(id=update.id).update(
+            start_datetime=start,
+            finish_datetime=start + timedelta(minutes=5),
+            cpu_time=timedelta(seconds=90),
+        )
+        RawDataCommand.objects.filter(id=clean.id).update(
+            start_datetime=start,
+            finish_datetime=start + timedelta(seconds=30),
+        )
+
+        self.assertIsNone(write_metrics())
+        data_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(data_dir, 'calaccess.prom')
+            self.assertEqual(write_metrics(path), path)
+            self.assertEqual(os.listdir(data_dir), ['calaccess.prom'])
+            with open(path) as f:
+                lines = f.read().splitlines()
+        finally:
+            shutil.rmtree(data_dir)
+
+        for line in (
+            'calaccess_raw_updates_total 1',
+            'calaccess_raw_update_finished 1',
+            'calaccess_raw_update_duration_seconds 300.0',
+            'calaccess_raw_update_cpu_seconds 90.0',
+            'calaccess_raw_last_success_release_timestamp_seconds 1456790400.0',
+            'calaccess_raw_table_clean_duration_seconds{table="RCPT_CD"} 30.0',
+            'calaccess_raw_table_clean_records{table="RCPT_CD"} 10',
+            'calaccess_raw_table_rejected_lines{table="RCPT_CD"} 3',
+            '# TYPE calaccess_raw_updates_total counter',
+        ):
+            self.assertIn(line, lines)
@@ -0,0 +1,100 @@
+import os
+import csv
+import time
+import hashlib
+import tempfile
+from csvkit import CSVKitWriter
+from hurry.filesize import size
+from calaccess_raw import get_download_directory
+from calaccess_raw.management.commands import CalAccessCommand
+from calaccess_raw.management.commands.cleancalaccessrawfile import (
+    clean_lines,
+    clean_blocks,
+    read_blocks,
+)
+
+
+class Command(CalAccessCommand):
+    help = 'Compare the speed of the line-by-line and block cleaning routines'
+
+    def add_arguments(self, parser):
+        """
+        Adds custom arguments specific to this command.
+        """
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            'file_names',
+            nargs='*',
+            help="Names of TSV files to clean. Defaults to all in the download directory."
+        )
+        parser.add_argument(
+            "--repeat",
+            action="store",
+            type=int,
+            dest="repeat",
+            default=3,
+            help="Number of times to time each routine. The best time is reported."
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        self.tsv_dir = os.path.join(get_download_directory(), "tsv/")
+        file_names = options['file_names'] or sorted(os.listdir(self.tsv_dir))
+        csv.field_size_limit(1000000000)
+
+        self.header("Benchmarking the cleaning of %s files" % len(file_names))
+        total_lines = 0
+        total_blocks = 0
+        for name in file_names:
+            tsv_path = os.path.join(self.tsv_dir, name)
+            lines_time, lines_hash = self.time_routine(
+                tsv_path,
+                lambda f, w, c: clean_lines(f, c, w),
+                options['repeat']
+            )
+            blocks_time, blocks_hash = self.time_routine(
+                tsv_path,
+                lambda f, w, c: clean_blocks(read_blocks(f), c, w),
+                options['repeat']
+            )
+            total_lines += lines_time
+            total_blocks += blocks_time
+
+            msg = " %s (%s): %.3fs by line, %.3fs by block (%.1fx)" % (
+                name,
+                size(os.path.getsize(tsv_path)),
+                lines_time,
+                blocks_time,
+                lines_time / max(blocks_time, 0.000001),
+            )
+            if lines_hash == blocks_hash:
+                self.log(msg)
+            else:
+                self.failure(msg + " OUTPUT DOES NOT MATCH")
+
+        self.success("Total: %.3fs by line, %.3fs by block (%.1fx)" % (
+            total_lines,
+            total_blocks,
+            total_lines / max(total_blocks, 0.000001),
+        ))
+
+    def time_routine(self, tsv_path, routine, repeat):
+        """
+        Runs a cleaning routine on a file and returns a tuple with its best
+        time in seconds and a hash of its output.
+        """
+        best = None
+        for i in range(repeat):
+            with open(tsv_path, 'rb') as tsv_file:
+                headers_count = len(tsv_file.readline().split(b'\t'))
+                with tempfile.TemporaryFile(mode='w+') as csv_file:
+                    csv_writer = CSVKitWriter(csv_file, quoting=csv.QUOTE_ALL)
+                    start = time.time()
+                    routine(tsv_file, csv_writer, headers_count)
+                    csv_file.flush()
+                    elapsed = time.time() - start
+                    csv_file.seek(0)
+                    digest = hashlib.md5(csv_file.read().encode('utf-8')).hexdigest()
+            if best is None or elapsed < best:
+                best = elapsed
+        return best, digest
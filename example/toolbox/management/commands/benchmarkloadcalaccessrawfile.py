@@ -0,0 +1,126 @@
+import time
+from django.apps import apps
+from django.db import connections, router
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from calaccess_raw import fields
+from calaccess_raw.management.commands import CalAccessCommand
+
+
+class Command(CalAccessCommand):
+    help = 'Compare the speed of loading with the SQL functions and the inline CASE expressions'
+
+    def add_arguments(self, parser):
+        """
+        Adds custom arguments specific to this command.
+        """
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            'model_names',
+            nargs='*',
+            default=['RcptCd'],
+            help="Names of models whose CSV files to load. Defaults to RcptCd."
+        )
+        parser.add_argument(
+            "--repeat",
+            action="store",
+            type=int,
+            dest="repeat",
+            default=3,
+            help="Number of times to time each load. The best time is reported."
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        self.header("Benchmarking the loading of %s files" % len(options['model_names']))
+        total_functions = 0
+        total_inline = 0
+        for name in options['model_names']:
+            model = apps.get_model("calaccess_raw", name)
+            if connections[router.db_for_write(model)].vendor != 'postgresql':
+                raise CommandError("The copy templates are only used by PostgreSQL.")
+
+            functions_time, functions_hash = self.time_load(model, options['repeat'])
+            templates = self.use_inline_templates()
+            try:
+                inline_time, inline_hash = self.time_load(model, options['repeat'])
+            finally:
+                self.restore_templates(templates)
+            total_functions += functions_time
+            total_inline += inline_time
+
+            msg = " %s (%s rows): %.3fs with functions, %.3fs inline (%.1fx)" % (
+                name,
+                model.objects.count(),
+                functions_time,
+                inline_time,
+                inline_time / max(functions_time, 0.000001),
+            )
+            if functions_hash == inline_hash:
+                self.log(msg)
+            else:
+                self.failure(msg + " TABLES DO NOT MATCH")
+
+        self.success("Total: %.3fs with functions, %.3fs inline (%.1fx)" % (
+            total_functions,
+            total_inline,
+            total_inline / max(total_functions, 0.000001),
+        ))
+
+    def use_inline_templates(self):
+        """
+        Swaps each field class's inline_copy_template in for its copy_template
+        and returns the originals so they can be restored.
+        """
+        templates = {}
+        for cls in (
+            fields.CharField,
+            fields.DateField,
+            fields.DateTimeField,
+            fields.DecimalField,
+            fields.FloatField,
+            fields.IntegerField,
+        ):
+            templates[cls] = cls.copy_template
+            cls.copy_template = cls.inline_copy_template
+        return templates
+
+    def restore_templates(self, templates):
+        """
+        Puts back the copy_templates returned by use_inline_templates.
+        """
+        for cls, template in templates.items():
+            cls.copy_template = template
+
+    def time_load(self, model, repeat):
+        """
+        Loads a model's CSV file and returns a tuple with the best time in
+        seconds and a hash of the loaded table.
+        """
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            call_command(
+                "loadcalaccessrawfile",
+                model.__name__,
+                keep_files=True,
+                verbosity=0,
+            )
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+
+        # Hash every column but the id, which changes with each load
+        columns = ", ".join(
+            '"%s"' % f.column for f in model._meta.fields if not f.primary_key
+        )
+        with connections[router.db_for_write(model)].cursor() as cursor:
+            cursor.execute(
+                'SELECT md5(string_agg(r, \',\' ORDER BY r)) FROM '
+                '(SELECT ROW(%s)::text AS r FROM "%s") AS t' % (
+                    columns,
+                    model._meta.db_table,
+                )
+            )
+            digest = cursor.fetchone()[0]
+        return best, digest